@@ -0,0 +1,1413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flow model based on the shallow ice approximation (Project 1).
+The functions used to live in code_given_updated.ipynb; they are kept in this
+file so that they can be imported by the notebook as well as by scripts.
+"""
+
+# the included functions are
+# get_bedrock            bedrock profile
+# get_grid, refined_grid the uniform grid, or a non-uniform grid refined around the glacier margin
+# remap_thickness        conservative remapping of the ice thickness to another grid
+# icemodel               the flowline model, for a single ela history
+# icemodel_ensemble      the flowline model, for many ela histories at once
+# MemorySink, MemmapSink, DownsampleSink   where icemodel puts its frames and yearly series
+# render_icemodel        animation and length plot of an icemodel run
+# render_many            render many runs in parallel processes
+# semi_implicit_step     one semi-implicit time step of the ice thickness (used by icemodel)
+# flux_kernel            in-place fluxes for icemodel(FastKernel=True), benchmark_kernel times it
+# PhaseTimer             optional timers of the phases of icemodel (timers=PhaseTimer()), see also benchmark_icemodel.py
+# ensemble_member        extract the output of one member of icemodel_ensemble
+# compute_response_time, compute_mass_change, avg_smb -> postprocessing
+# save_state, load_state compact savestate format (.npz), convert_savestates converts the old pickles
+# load_initial_state     load a spin-up state from the Savestates directory
+# run_sweep              run a grid of experiments in parallel processes and collect the postprocessing
+# cached_icemodel        icemodel with an on-disk result cache (see also fingerprint, cache_key, cache_evict)
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import os
+import pickle
+import hashlib
+import json
+import inspect
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.linalg import solve_banded
+
+rho   =  917.      # kg/m3
+g     =    9.80665 # m/s2
+fd    =    1.9E-24 # # pa-3 s-1 # this value and dimension is only correct for n=3
+fs    =    5.7E-20 # # pa-3 m2 s-1 # this value and dimension is only correct for n=3
+
+
+# this ELA list is not quite systematic, so make it systematic!
+# elalist = np.array([1800.])  # m , 1750., 1700., 1500., 2200., 1900., 1800.,
+# elayear = np.array([ 500], dtype=int)  # years    ,    100,   100,   150,    10,   100,   100
+
+cd    = 2/5*(rho**3)*(g**3)*fd  # <<< this must be adjused according to your discretisation -- Done
+cs    = (rho**3)*(g**3)*fs  # <<< this must be adjused according to your discretisation -- Done
+
+# change this when the model changes, such that old results in the cache are not used anymore
+cache_version = "1"
+
+# version of the savestate format (see save_state), and the arrays needed to restart a run
+savestate_version = 1
+prognostic_keys   = ['hice', 'dhdx', 'fluxd', 'fluxs', 'dhdtif', 'smb']
+
+
+def get_bedrock(xaxis,slope=0.08):
+    '''
+    Function to get bedrock. 
+    IN: 
+    xaxis = array
+    slope = slope of underground, scalar
+    OUT:
+    bedrock profile
+    '''
+    # here you put in your own equation that defines the bedrock
+    bedrock = 2000. - xaxis*slope
+    return bedrock
+
+
+def get_grid(totL, dx, grid=None):
+    '''
+    The grid of icemodel.
+    IN:
+    totL, dx = length of the domain and grid size of the uniform grid
+    grid     = None for the uniform grid, or the cell faces from 0 to totL (see refined_grid)
+    OUT:
+    nx, dx (for a non-uniform grid the smallest cell), xaxis (the points, in the centres of the cells),
+    xhaxs (the faces between the cells, in km), dxnode (distances between the points, where the
+    fluxes are) and dxcell (widths of the cells). For the uniform grid dxnode and dxcell are dx.
+    '''
+    if grid is None:
+        nx    = int(totL/dx)
+        dx    = totL/nx       # redefine, as it
+        xaxis = np.linspace(0,totL,nx,False) + dx*0.5
+        xhaxs = np.linspace(dx,totL,nx-1,False) / 1000.
+        return nx, dx, xaxis, xhaxs, dx, dx
+
+    faces = np.asarray(grid, dtype=float)
+    assert faces[0] == 0. and np.isclose(faces[-1], totL), 'the grid should run from 0 to totL!'
+    assert np.all(np.diff(faces) > 0.), 'the faces of the grid should be increasing!'
+    nx     = np.size(faces) - 1
+    dxcell = np.diff(faces)
+    xaxis  = (faces[1:] + faces[:-1]) * 0.5
+    dxnode = np.diff(xaxis)
+    return nx, np.min(dxcell), xaxis, faces[1:-1] / 1000., dxnode, dxcell
+
+
+def refined_grid(totL, dxmin, dxmax, xmargin, width=1000., growth=1.1):
+    '''
+    Cell faces of a non-uniform grid for icemodel(grid=...): cells of dxmin within width of the
+    glacier margin positions xmargin (e.g. the initial and the expected final margin, the grid is
+    fine in between as well), growing by a factor growth per cell up to dxmax away from there.
+    The dx study (run_different_dx) shows that the resolution near the margin sets the accuracy,
+    so this gives about the result of the uniform dxmin grid with far fewer points.
+    IN:
+    totL          = length of the domain (m)
+    dxmin, dxmax  = smallest and largest cell (m)
+    xmargin       = scalar or list of margin positions (m), e.g. the 'Glacier Length' of a spin-up
+    OUT:
+    array [nx+1], the cell faces from 0 to totL
+    '''
+    xleft  = max(np.min(xmargin) - width, 0.)
+    xright = min(np.max(xmargin) + width, totL)
+    # the cells outside the refined band, from the band outwards, stretched a bit to fit exactly
+    def coarse(length):
+        cells = []
+        while sum(cells) < length:
+            cells.append(min(dxmin*growth**(len(cells)+1), dxmax))
+        if len(cells) > 1 and sum(cells) - length > length - sum(cells[:-1]):
+            cells.pop()
+        cells = np.array(cells)
+        return cells*length/np.sum(cells) if np.size(cells) > 0 else cells
+    # do not leave cells smaller than dxmin at the ends of the domain
+    if xleft < dxmin*growth:
+        xleft = 0.
+    if totL - xright < dxmin*growth:
+        xright = totL
+    left  = coarse(xleft)[::-1]
+    nfine = max(int(round((xright - xleft)/dxmin)), 1)
+    fine  = np.full(nfine, (xright - xleft)/nfine)
+    right = coarse(totL - xright)
+    faces = np.concatenate([[0.], np.cumsum(np.concatenate([left, fine, right]))])
+    faces[-1] = totL
+    return faces
+
+
+def remap_thickness(hice, faces, newfaces):
+    '''
+    Conservative remapping of the ice thickness (cell averages) from the cells with faces to the
+    cells with newfaces, both from 0 to totL: the volume in each new cell is kept.
+    '''
+    volume = np.concatenate([[0.], np.cumsum(hice*np.diff(faces))])
+    return np.diff(np.interp(newfaces, faces, volume)) / np.diff(newfaces)
+
+
+def integrate_cells(values, dxcell):
+    '''integral of cell values, like the volume from hice; dxcell is a scalar for the uniform grid'''
+    if np.ndim(dxcell) == 0:
+        return np.sum(values)*dxcell
+    return np.sum(values*dxcell)
+
+
+class MemorySink:
+    '''
+    Output of icemodel, kept in memory (the default).
+    icemodel opens the sink, gives it every year (add_year) and every ndyfigure years
+    a frame for the animation (add_frame), and adds the result of close to its returndict.
+    Frame 0 is not written (it stays zero), as before.
+    '''
+    def open(self, nx, nyear, ndyfigure):
+        self.ndyfigure = ndyfigure
+        nframes        = nyear//ndyfigure + 1
+        self.allocate(nx, nyear, nframes)
+
+    def allocate(self, nx, nyear, nframes):
+        self.lengthmem = np.zeros(nyear+1)
+        self.volumemem = np.zeros(nyear+1)
+        self.elamemory = np.zeros(nyear+1)
+        self.hsurfmem  = np.zeros([nx,nframes])
+        self.smbmem    = np.zeros([nx,nframes])
+        self.ifdmem    = np.zeros([nx,nframes])
+        self.fldmem    = np.zeros([nx-1,nframes])
+        self.flsmem    = np.zeros([nx-1,nframes])
+
+    def add_year(self, iy, length, volume, ela):
+        self.lengthmem[iy] = length
+        self.volumemem[iy] = volume
+        self.elamemory[iy] = ela
+
+    def add_frame(self, iframe, hsurf, smb, ifd, fld, fls):
+        self.hsurfmem[:,iframe] = hsurf
+        self.smbmem[:,iframe]   = smb
+        self.ifdmem[:,iframe]   = ifd
+        self.fldmem[:,iframe]   = fld
+        self.flsmem[:,iframe]   = fls
+
+    def close(self, iframes):
+        return {
+            'ndyfigure':self.ndyfigure,
+            'iframes':iframes,
+            'Glacier Length':self.lengthmem,
+            'Glacier Volume':self.volumemem,
+            'Glacier ELA':self.elamemory,
+            'Glacier Height':self.hsurfmem,
+            'Surface Mass Balance':self.smbmem,
+            'ifd':self.ifdmem,
+            'fld':self.fldmem,
+            'fls':self.flsmem,
+        }
+
+
+class MemmapSink(MemorySink):
+    '''
+    Output of icemodel, written to memory-mapped .npy files in directory, such that long runs
+    do not need to keep all frames in memory. The frames are stored one after the other
+    (name_hsurf.npy etc. are [nframes, nx]), the yearly series in name_years.npy
+    (rows length, volume and ela). The returndict gets [nx, nframes] views on these files.
+    Frames written before a run stopped (NaN, out of domain) stay in the files.
+    Read them back with np.load(filename, mmap_mode='r').
+    '''
+    def __init__(self, directory, name='icemodel'):
+        self.directory = directory
+        self.name      = name
+
+    def filename(self, var):
+        return os.path.join(self.directory, '{0:s}_{1:s}.npy'.format(self.name, var))
+
+    def allocate(self, nx, nyear, nframes):
+        os.makedirs(self.directory, exist_ok=True)
+        openmm = lambda var, shape: np.lib.format.open_memmap(self.filename(var), mode='w+', shape=shape)
+        self.years = openmm('years', (3,nyear+1))
+        self.lengthmem, self.volumemem, self.elamemory = self.years
+        self.frames = [openmm(var, (nframes,n)) for var, n in
+                       [('hsurf',nx), ('smb',nx), ('ifd',nx), ('fld',nx-1), ('fls',nx-1)]]
+        self.hsurfmem, self.smbmem, self.ifdmem, self.fldmem, self.flsmem = [mm.T for mm in self.frames]
+
+    def close(self, iframes):
+        for mm in [self.years] + self.frames:
+            mm.flush()
+        return super().close(iframes)
+
+
+class DownsampleSink:
+    '''
+    Passes every year, but only every every-th frame, on to sink (default MemorySink).
+    The animation of the result then has a frame every ndyfigure*every years.
+    '''
+    def __init__(self, every, sink=None):
+        self.every = every
+        self.sink  = MemorySink() if sink is None else sink
+
+    def open(self, nx, nyear, ndyfigure):
+        self.sink.open(nx, nyear, ndyfigure*self.every)
+
+    def add_year(self, iy, length, volume, ela):
+        self.sink.add_year(iy, length, volume, ela)
+
+    def add_frame(self, iframe, hsurf, smb, ifd, fld, fls):
+        if iframe%self.every == 0:
+            self.sink.add_frame(iframe//self.every, hsurf, smb, ifd, fld, fls)
+
+    def close(self, iframes):
+        return self.sink.close(iframes//self.every)
+
+
+class PhaseTimer:
+    '''
+    Wall time and number of passes of the phases of a run, switched on by giving one to icemodel
+    (timers=PhaseTimer()). start marks the beginning, lap(phase) adds the time since the previous
+    mark to phase. The phases of icemodel are 'setup', 'flux' (fluxes, flux convergence and the
+    adaptive time step), 'smb' (smb and thickness update), 'bookkeeping' (yearly series, frames and
+    the steady state check) and 'render'. One timer can be used for several runs, the times add up.
+    '''
+    def __init__(self):
+        self.seconds = {}
+        self.calls   = {}
+        self.mark    = None
+
+    def start(self):
+        self.mark = time.perf_counter()
+
+    def lap(self, phase, calls=1):
+        now = time.perf_counter()
+        self.seconds[phase] = self.seconds.get(phase, 0.) + now - self.mark
+        self.calls[phase]   = self.calls.get(phase, 0) + calls
+        self.mark = now
+
+    def report(self, show=True):
+        '''dict with per phase the total seconds, the number of passes and the share of the total time'''
+        total  = sum(self.seconds.values())
+        report = {phase: {'seconds': self.seconds[phase], 'calls': self.calls[phase],
+                          'fraction': self.seconds[phase]/total if total > 0. else 0.} for phase in self.seconds}
+        if show:
+            print('phase          seconds      calls   fraction')
+            for phase, entry in report.items():
+                print('{0:12s} {1:9.3f} {2:10d} {3:9.1%}'.format(phase, entry['seconds'], entry['calls'], entry['fraction']))
+        return report
+
+
+def icemodel(elalist,elayear,totL=20000,dx=100,ntpy=200,ZeroFluxBoundary=True,FluxAtPoints=True,ndyfigure=5,dbdh=0.007, maxb=2, initial_state=None, savename=None, adaptive=False, cfl=0.5, SemiImplicit=False, steadytol=None, steadyyears=10, render=True, sink=None, FastKernel=False, timers=None, grid=None):
+    StopWhenOutOfDomain = True  
+    # Start calculations
+    # constants that rely on input
+
+    # with adaptive=True the time step is not 1/ntpy year, but is taken each step
+    # from the stability limit of the explicit scheme, dt = cfl*dx^2/(6*max(diffusivity)).
+    # The factor 6 instead of 2: the flux goes with dhdx^3, so the diffusivity of the linearised
+    # update is 3 times the effective diffusivity D = (cd*h^5 + cs*h^3)*dhdx^2.
+    # The steps are shortened such that every year ends exactly on a year boundary.
+    # with SemiImplicit=True the thickness update is solved implicitly (see semi_implicit_step),
+    # which is stable for much larger time steps (small ntpy).
+    # with steadytol given, the run stops once the glacier is in steady state during the last ela:
+    # the relative change per year of volume and length, and the integrated smb plus flux
+    # convergence over the glacier relative to its volume, are all below steadytol for
+    # steadyyears years in a row. The remaining years are filled with the final state.
+    # with render=False no figures are made, only the frames are returned (see render_icemodel).
+    # sink receives the yearly series and the frames, by default they are kept in memory
+    # (see MemorySink, MemmapSink and DownsampleSink).
+    # with FastKernel=True the fluxes, smb and explicit update are done in place in preallocated
+    # arrays (see flux_kernel); the result agrees with the normal path to rounding errors.
+    # with timers (a PhaseTimer) the time spent in each phase of the run is added to it.
+    # with grid (the cell faces, see refined_grid) the grid is not uniform and dx is not used.
+    # The fluxes are then on the faces between the points (FluxAtPoints=False) and the adaptive
+    # time step follows from the local spacing. An initial state on another grid is remapped.
+    if timers is not None:
+        timers.start()
+    if grid is not None:
+        assert not FluxAtPoints, 'a non-uniform grid needs the fluxes between the points (FluxAtPoints=False)!'
+        # the explicit scheme needs the same time step as the uniform grid of the smallest cells
+        dx = round(np.min(np.diff(grid)))
+    if dx == 50 and not adaptive and not SemiImplicit:
+        ntpy = ntpy*8
+
+    nx, dx, xaxis, xhaxs, dxnode, dxcell = get_grid(totL, dx, grid)
+    if grid is not None:
+        # the local dx^2 of the stability limit at each face: the smallest cell next to it
+        dxstab = dxnode*np.minimum(dxcell[1:], dxcell[:-1])
+    bedrock = get_bedrock(xaxis)
+
+    if initial_state is None:
+
+        dt    = 365.*86400./ntpy # in seconds!
+        
+        hice   = np.zeros(nx)    # ice thickness
+        dhdx   = np.zeros(nx)    # the local gradient of h
+        fluxd  = np.zeros(nx+2)  # this will be the flux per second!!!!
+        fluxs  = np.zeros(nx+2)  # this will be the flux per second!!!!
+        dhdtif = np.zeros(nx)    # change in ice thickness due to the ice flux, per second
+        smb    = np.zeros(nx)
+
+        # preparations for the ela-selection
+        # elaswch is a list of time steps on which a new ela value should be used.
+        nyear    = int(np.sum(elayear))
+        nela     = np.size(elalist)
+    
+    else:
+        initgrid = initial_state.get('Grid')
+        assert grid is not None or initgrid is None, 'the initial state has a non-uniform grid, give it as grid!'
+        assert grid is not None or nx == initial_state['nx'], 'nx input and initial state should match!'
+        assert adaptive or SemiImplicit or ntpy == initial_state['ntpy'], 'ntpy input and initial state should match!'
+
+        dt = 365.*86400./ntpy # in seconds!
+
+        if grid is None or (initgrid is not None and np.size(initgrid) == nx+1 and np.allclose(initgrid, grid)):
+            # copies, such that the initial state itself is not changed by the run
+            hice   = np.array(initial_state['hice'])    # ice thickness
+            dhdx   = np.array(initial_state['dhdx'])    # the local gradient of h
+            fluxd  = np.array(initial_state['fluxd'])  # this will be the flux per second!!!!
+            fluxs  = np.array(initial_state['fluxs'])  # this will be the flux per second!!!!
+            dhdtif = np.array(initial_state['dhdtif'])    # change in ice thickness due to the ice flux, per second
+            smb    = np.array(initial_state['smb']) # TODO: potentially force to zero?
+        else:
+            # the initial state is on another grid: keep its ice volume, the rest follows in the first time step
+            if initgrid is None:
+                initgrid = np.linspace(0, totL, initial_state['nx']+1)
+            hice   = remap_thickness(np.asarray(initial_state['hice']), initgrid, grid)
+            dhdx   = np.zeros(nx)
+            fluxd  = np.zeros(nx+2)
+            fluxs  = np.zeros(nx+2)
+            dhdtif = np.zeros(nx)
+            smb    = np.zeros(nx)
+
+        # preparations for the ela-selection
+        # elaswch is a list of time steps on which a new ela value should be used.
+        nyear    = int(np.sum(elayear))
+        nela     = np.size(elalist)
+
+
+    assert nela == np.size(elayear), "the arrays of elalist and elayear does not have the same length!" 
+    # here elaswch is in years, such that it also works for the adaptive time step
+    elaswch = np.zeros(nela)
+    for i in range(0,nela-1):
+        elaswch[i+1] = elaswch[i] + elayear[i]
+    ela     = elalist[0]
+        
+
+    # preparations for the animation and response time calculations
+    if sink is None:
+        sink = MemorySink()
+    sink.open(nx, nyear, ndyfigure)
+    iframes  = 0
+    yearlist = np.arange(nyear+1)
+    
+    # (re)set initial values so that the accumulation area has glacier right away.
+    hice = np.where(bedrock>ela, np.where(hice<0.11, 0.11, hice), hice)
+    
+    length = np.sum(np.where(hice>0.1, dxcell, 0.))
+    volume = integrate_cells(hice, dxcell)
+    sink.add_year(0, length, volume, ela)
+
+
+    #0-----------------------------------------------------------------------------
+    print("Run model for {0:3d} years".format(nyear))
+
+    yrsec = 365.*86400.
+    it    = 0    # number of time steps taken
+    iy    = 0    # number of completed years
+    tyear = 0.   # time since the start of the current year, in seconds
+    startofyear = True
+    nsteady    = 0     # number of consecutive years that satisfy the steady state criterion
+    steadyyear = None  # year in which the steady state was reached
+    stopreason = None  # why the run stopped before the end, if it did
+    if FastKernel:
+        work = work_buffers(nx)
+    if timers is not None:
+        timers.lap('setup')
+    while iy < nyear:
+        it += 1
+        if FastKernel:
+            h = flux_kernel(hice, bedrock, dxnode, dhdx, fluxd, fluxs, dhdtif, work, FluxAtPoints, dxcell)
+        else:
+            h = hice + bedrock
+            if FluxAtPoints:
+                dhdx[1:-1] = (h[2:]-h[:-2])/(2*dx)
+
+                # the following equations needs to be adjusted according to your discretisation
+                # note that flux[1] is at the point 0
+                fluxd[1:-1] = cd * (dhdx)**3 * (hice)**5  
+                fluxs[1:-1] = cs * (dhdx)**3 * (hice)**3
+
+                # derive flux convergence
+                dhdtif[:]  = (fluxd[2:]-fluxd[:-2]+fluxs[2:]-fluxs[:-2])/(2*dx)
+            else:
+                # the following equations needs to be adjusted according to your discretisation
+                dhdx[:-1]  = ((h[1:]-h[:-1])/dxnode) # so 0 is at 1/2 actually
+                # note that flux[1] is at the point 1/2
+                fluxd[1:-2] = cd * dhdx[:-1]**3 * ( ((hice[1:]**5)+(hice[:-1])**5) * 0.5 )
+                fluxs[1:-2] = cs * dhdx[:-1]**3 * ( ((hice[1:]**3)+(hice[:-1])**3) * 0.5 )
+
+                # derive flux convergence
+                dhdtif[:]  = (fluxd[1:-1]-fluxd[:-2] + fluxs[1:-1]-fluxs[:-2])/dxcell
+
+        if adaptive:
+            # effective diffusivity D = (cd*h^5 + cs*h^3)*dhdx^2, at the points where the fluxes are
+            if FluxAtPoints:
+                diffus = (cd*hice**5 + cs*hice**3) * dhdx**2
+            else:
+                hmax   = np.maximum(hice[1:], hice[:-1])
+                diffus = (cd*hmax**5 + cs*hmax**3) * dhdx[:-1]**2
+            if grid is None:
+                maxdiffus = np.max(diffus)
+            else:
+                # the stability limit of each face, relative to dx^2
+                maxdiffus = np.max(diffus/dxstab) * dx**2
+            if maxdiffus > 0.:
+                dt = cfl*dx**2/(6.*maxdiffus)
+            else:
+                dt = yrsec
+            # do not step over the end of the year
+            endofyear = dt >= yrsec - tyear
+            if endofyear:
+                dt = yrsec - tyear
+            tyear += dt
+        else:
+            endofyear = it%ntpy == 0
+        if timers is not None:
+            timers.lap('flux')
+
+        # calculate smb (per year)
+        # first update ela (once a year)
+        if startofyear:
+            # lists the elements of elaswch that are equal or smaller than the number of completed years
+            [ielanow] = np.nonzero(elaswch<=iy) 
+            # the last one is the current ela
+            ela       = elalist[ielanow[-1]]   
+    
+        if FastKernel:
+            np.subtract(h, ela, out=smb)
+            np.multiply(smb, dbdh, out=smb)
+            np.minimum(smb, maxb, out=smb)
+        else:
+            smb[:] = (h-ela)*dbdh
+            smb[:] = np.where(smb>maxb, maxb, smb)
+        
+        
+        
+        if FastKernel:
+            smbdt = work['smbdt']
+            if adaptive:
+                np.multiply(smb, dt, out=smbdt)
+                np.divide(smbdt, yrsec, out=smbdt)
+            else:
+                np.divide(smb, ntpy, out=smbdt)
+        elif adaptive:
+            smbdt = smb*dt/yrsec
+        else:
+            smbdt = smb/ntpy
+        if SemiImplicit:
+            hnew      = semi_implicit_step(hice, bedrock, smbdt, dt, dxnode, dhdx, fluxd, fluxs, FluxAtPoints, ZeroFluxBoundary,
+                                           None if grid is None else dxcell)
+            dhdtif[:] = (hnew - hice - smbdt)/dt # the flux convergence that is actually used
+            hice[:]   = hnew
+        elif FastKernel:
+            np.multiply(dhdtif, dt, out=work['tmp'])
+            np.add(smbdt, work['tmp'], out=work['tmp'])
+            np.add(hice, work['tmp'], out=hice)
+        else:
+            hice += smbdt + dt*dhdtif
+        if FastKernel:
+            np.maximum(hice, 0., out=hice) # remove negative ice thicknesses
+        else:
+            hice[:] = np.where(hice<0., 0., hice) # remove negative ice thicknesses
+
+        if ZeroFluxBoundary == False:
+            hice[0] = hice[-1] = 0.
+        if timers is not None:
+            timers.lap('smb')
+
+        startofyear = endofyear
+        if endofyear:
+            tyear = 0.
+            iy   += 1
+            if np.any(np.isnan(hice)):
+                print('Values got NaN!')
+                stopreason = 'NaN'
+                break
+            prevlength, prevvolume = length, volume
+            length = np.sum(np.where(hice>0.1, dxcell, 0.))
+            volume = integrate_cells(hice, dxcell)
+            sink.add_year(iy, length, volume, ela)
+
+        if endofyear and iy%ndyfigure == 0:
+            iframes += 1
+            sink.add_frame(iframes, hice + bedrock, smb, dhdtif*365.*86400.,
+                           -fluxd[1:-2]*365.*86400., -fluxs[1:-2]*365.*86400.)
+            if StopWhenOutOfDomain:
+                if hice[-1]>1.:
+                    print("Ice at end of domain!")
+                    stopreason = 'out of domain'
+                    break
+
+        if endofyear and steadytol is not None and iy >= elaswch[-1] and volume > 0.:
+            relvolume  = abs(volume-prevvolume)/volume
+            rellength  = abs(length-prevlength)/length
+            icecovered = hice>0.1
+            imbalance  = abs(integrate_cells(smb[icecovered] + dhdtif[icecovered]*365.*86400.,
+                                             dxcell if grid is None else dxcell[icecovered]))/volume
+            if max(relvolume, rellength, imbalance) < steadytol:
+                nsteady += 1
+            else:
+                nsteady  = 0
+            if nsteady >= steadyyears:
+                steadyyear = iy
+                print("Steady state reached after {0:3d} years".format(steadyyear))
+                # fill the remaining years (and frames) with the final state
+                for jy in range(iy+1, nyear+1):
+                    sink.add_year(jy, length, volume, ela)
+                    if jy%ndyfigure == 0:
+                        iframes = jy//ndyfigure
+                        sink.add_frame(iframes, hice + bedrock, smb, dhdtif*365.*86400.,
+                                       -fluxd[1:-2]*365.*86400., -fluxs[1:-2]*365.*86400.)
+                break
+        if timers is not None:
+            timers.lap('bookkeeping')
+
+    #------------------------------------------------------------------------------        
+    # at this point, the simulation is completed.        
+    returndict = {
+        'nx': nx,
+        'ntpy':ntpy,
+        'dx':dx,
+        'totL':totL,
+        'nsteps':it,
+        'Steady year':steadyyear,
+        'Stop reason':stopreason,
+        'years':yearlist,
+        'hice':hice,
+        'dhdx':dhdx,
+        'fluxd':fluxd,
+        'fluxs':fluxs,
+        'dhdtif':dhdtif,
+        'smb':smb, #= smbmem[:, -1]
+        'Bedrock': bedrock,
+    }
+    if grid is not None:
+        returndict['Grid'] = np.array(grid, dtype=float)
+    returndict.update(sink.close(iframes))
+    if timers is not None:
+        timers.lap('bookkeeping', calls=0) # closing the sink, and the last year when the run stopped early
+
+    if render:
+        render_icemodel(returndict, savename=savename)
+        if timers is not None:
+            timers.lap('render')
+    return returndict
+
+
+def render_icemodel(results, savename=None, plotdir=os.path.join('..', 'Plots')):
+    '''
+    Make the animation (gif) and the length plot (_len.png) of an icemodel run.
+    IN:
+    results  = returndict of icemodel (or of ensemble_member), or the filename of a pickled one
+    savename = name of the files in plotdir. If None, the animation is written to temp.gif
+               and the figures are left open.
+    '''
+    if isinstance(results, str):
+        with open(results, 'rb') as f:
+            results = pickle.load(f)
+
+    nx        = results['nx']
+    dx        = results['dx']
+    totL      = results.get('totL', nx*dx)
+    bedrock   = results['Bedrock']
+    hsurfmem  = results['Glacier Height']
+    smbmem    = results['Surface Mass Balance']
+    ifdmem    = results['ifd']
+    fldmem    = results['fld']
+    flsmem    = results['fls']
+    yearlist  = results['years']
+    lengthmem = results['Glacier Length']
+    elamemory = results['Glacier ELA']
+    nyear     = yearlist[-1]
+    # results from before these entries were saved: assume all frames are filled
+    iframes   = results.get('iframes', np.shape(hsurfmem)[1]-1)
+    ndyfigure = results.get('ndyfigure', max(nyear//max(np.shape(hsurfmem)[1]-1, 1), 1))
+    xaxis     = np.linspace(0,totL,nx,False) + dx*0.5
+    xhaxs     = np.linspace(dx,totL,nx-1,False) / 1000.
+    if 'Grid' in results:
+        nx, dx, xaxis, xhaxs, dxnode, dxcell = get_grid(totL, dx, results['Grid'])
+
+    # the following is needed to make the animation        
+    fig  = plt.figure()
+    ax1  = fig.add_subplot(311, autoscale_on=False, xlim=(0,totL/1000.), \
+                          ylim=(np.min(bedrock),np.max(hsurfmem)+10.))
+    ax1.set_ylabel('meter')
+    ax1.set_xlabel('km')
+    mina2 = min(np.min(smbmem),np.min(ifdmem))
+    maxa2 = max(np.max(smbmem),np.max(ifdmem))
+    ax2   = fig.add_subplot(312, autoscale_on=False, xlim=(0,totL/1000.), \
+                          ylim=(mina2,maxa2))
+    ax2.set_ylabel('I dont know')
+    ax2.set_xlabel('km')
+    mina3 = min(np.min(fldmem),np.min(flsmem))
+    maxa3 = max(np.max(fldmem),np.max(flsmem))
+    ax3   = fig.add_subplot(313, autoscale_on=False, xlim=(0,totL/1000.), \
+                          ylim=(mina3,maxa3))
+    ax3.set_xlabel('km')
+    ax3.set_ylabel('fluxd/fluxm')
+
+    # define the line types
+    bedrline, = ax1.plot([],[],'-', c='saddlebrown') 
+    hsrfline, = ax1.plot([],[],'-', c='navy') #bedrline, +total surface 
+    
+    time_template = 'time = %d y'
+    time_text = ax1.text(0.5, 0.92, '', transform=ax1.transAxes )
+    smbline,  = ax2.plot([],[],'-', c='navy') #surface mass balance
+    ifdline,  = ax2.plot([],[],'-', c='red') #ifd
+    fxdline,  = ax3.plot([],[],'-', c='navy') #flux
+    fxsline,  = ax3.plot([],[],'-', c='red') #flux
+
+    # initialize the animation
+    def init_anim():
+        '''function for initial animamtion'''
+        bedrline.set_data([], [])
+        hsrfline.set_data([], [])
+        time_text.set_text('')
+        smbline.set_data([], [])
+        ifdline.set_data([], [])
+        fxdline.set_data([], [])
+        fxsline.set_data([], [])
+
+        return bedrline, hsrfline, time_text, smbline, ifdline, fxdline, fxsline
+
+    # update the animation with data for saved frame #tf
+    def animate(tf):
+        bedrline.set_data(xaxis/1000., bedrock)
+        hsrfline.set_data(xaxis/1000., hsurfmem[:,tf]) 
+        time_text.set_text(time_template % int(tf*ndyfigure))
+        smbline.set_data(xaxis/1000.,  smbmem[:,tf])
+        ifdline.set_data(xaxis/1000.,  ifdmem[:,tf])
+        fxdline.set_data(xhaxs      ,  fldmem[:,tf])
+        fxsline.set_data(xhaxs      ,  flsmem[:,tf])
+        return bedrline, hsrfline, time_text, smbline, ifdline, fxdline, fxsline
+
+    # call and run animation
+    ani = animation.FuncAnimation(fig, animate, np.arange(iframes),
+             interval=25, blit=True, init_func=init_anim) 
+    
+    writergif = animation.PillowWriter(fps=30)
+    
+    if savename is not None:
+        s = os.path.join(plotdir, f'{savename}.gif')
+        ani.save(s, writer=writergif)
+        plt.close()
+    else:
+        s = os.path.join(plotdir, 'temp.gif')
+        ani.save(s, writer=writergif)
+    
+    # SAVING PYTHON MOVIES IS PLATFORM DEPENDEND.     
+
+    
+    #------------------------------------------------------------------------------ 
+    # postprocessing
+
+    # The first ela value is excluded from the analysis as that has the spin-up
+    # Here, the length is used for the responsetime. One could also take the mass. 
+    #  If desired, do not use lengthmem but volumemem.
+
+
+    fig2,ax2a = plt.subplots()
+    ax2a.plot(yearlist,lengthmem/1000. ,'k') #Black line 
+    ax2a.set_xlabel('Model year [yr]')
+    ax2a.set_ylabel('Glacier length [km]')
+    ax2a.set_xlim([0, nyear])
+    lmima = [ np.min(lengthmem/1000.), np.max(lengthmem/1000.) ]
+
+    ax2b  = ax2a.twinx()
+    color = 'tab:red'
+    ax2b.plot(yearlist, elamemory, color=color) #Red line
+    ax2b.set_ylabel('ELA [m]', color=color)
+    ax2b.tick_params(axis='y', labelcolor=color)
+
+    if savename is not None:
+        s = os.path.join(plotdir, f'{savename}_len.png')
+        plt.savefig(s)
+        plt.close()
+    
+
+
+def render_worker_init():
+    '''use a non-interactive backend in the rendering processes'''
+    plt.switch_backend('Agg')
+
+
+def render_many(jobs, nworkers=None, plotdir=os.path.join('..', 'Plots')):
+    '''
+    Render many icemodel results in parallel worker processes.
+    IN:
+    jobs     = list of (results, savename), with results a returndict or the filename of a pickled one
+    nworkers = number of processes, default is the number of cores
+    '''
+    with ProcessPoolExecutor(max_workers=nworkers, initializer=render_worker_init) as pool:
+        futures = [pool.submit(render_icemodel, results, savename, plotdir) for results, savename in jobs]
+        for future in futures:
+            future.result()
+
+
+def semi_implicit_step(hice,bedrock,smbdt,dt,dx,dhdx,fluxd,fluxs,FluxAtPoints=True,ZeroFluxBoundary=True,dxcell=None):
+    '''
+    One semi-implicit time step of the ice thickness.
+    The (nonlinear) diffusivity D = (cd*h^5 + cs*h^3)*dhdx^2 is taken from the current state,
+    the surface gradient in the flux is taken at the new time level. This gives a banded
+    system (tridiagonal for FluxAtPoints=False, pentadiagonal for FluxAtPoints=True).
+    IN:
+    hice, bedrock = arrays [nx] at the current time
+    smbdt         = surface mass balance over this time step (m), array [nx]
+    dt            = time step in seconds
+    dhdx, fluxd, fluxs = as computed by icemodel for the current time
+    dxcell        = for a non-uniform grid (only FluxAtPoints=False) the cell widths [nx],
+                    dx are then the distances between the points [nx-1]
+    OUT:
+    ice thickness at the new time (not yet clipped at zero)
+    '''
+    nx  = np.size(hice)
+    rhs = hice + smbdt
+    if FluxAtPoints:
+        # fluxes at the points: F_i = D_i*(S_i+1 - S_i-1)/(2dx)
+        # only the fluxes at 1..nx-2 depend on the surface, the ones at 0 and nx-1 are kept as they are
+        coef = np.zeros(nx)
+        coef[1:-1] = dt*(cd*hice[1:-1]**5 + cs*hice[1:-1]**3) * dhdx[1:-1]**2 / (4*dx**2)
+        cup  = np.zeros(nx)   # coefficient of the flux at i+1, for row i
+        cdn  = np.zeros(nx)   # coefficient of the flux at i-1, for row i
+        cup[:-1] = coef[1:]
+        cdn[1:]  = coef[:-1]
+        band = 2
+        ab = np.zeros([5, nx])
+        ab[0, 2:]  = -cup[:-2]        # a[i,i+2]
+        ab[2, :]   = 1. + cup + cdn   # a[i,i]
+        ab[4, :-2] = -cdn[2:]         # a[i,i-2]
+        rhs[:-2] += cup[:-2]*(bedrock[2:]-bedrock[:-2])
+        rhs[2:]  -= cdn[2:]*(bedrock[2:]-bedrock[:-2])
+        # explicit contribution of the fluxes at the end points
+        rhs[1]  -= dt*(fluxd[1]+fluxs[1])/(2*dx)
+        rhs[-2] += dt*(fluxd[-2]+fluxs[-2])/(2*dx)
+    else:
+        # fluxes halfway the points: F_i+1/2 = D_i+1/2*(S_i+1 - S_i)/dx, zero at the boundaries
+        if dxcell is None:
+            coef = dt*dhdx[:-1]**2 * ( cd*((hice[1:]**5)+(hice[:-1])**5) * 0.5 + \
+                                       cs*((hice[1:]**3)+(hice[:-1])**3) * 0.5 ) / dx**2
+            cup = cdn = coef
+        else:
+            # the flux convergence of cell i is divided by its own width
+            coef = dt*dhdx[:-1]**2 * ( cd*((hice[1:]**5)+(hice[:-1])**5) * 0.5 + \
+                                       cs*((hice[1:]**3)+(hice[:-1])**3) * 0.5 ) / dx
+            cup  = coef/dxcell[:-1]   # coefficient of face i+1/2, for row i
+            cdn  = coef/dxcell[1:]    # coefficient of face i+1/2, for row i+1
+        band = 1
+        ab = np.zeros([3, nx])
+        ab[0, 1:]   = -cup            # a[i,i+1]
+        ab[1, :]    = 1.
+        ab[1, :-1] += cup
+        ab[1, 1:]  += cdn
+        ab[2, :-1]  = -cdn            # a[i,i-1]
+        rhs[:-1] += cup*(bedrock[1:]-bedrock[:-1])
+        rhs[1:]  -= cdn*(bedrock[1:]-bedrock[:-1])
+
+    if ZeroFluxBoundary == False:
+        # fixed zero ice thickness at both ends
+        for irow in [0, nx-1]:
+            for iband in range(2*band+1):
+                icol = irow - iband + band
+                if 0 <= icol < nx:
+                    ab[iband, icol] = 0.
+            ab[band, irow] = 1.
+            rhs[irow]      = 0.
+
+    return solve_banded((band, band), ab, rhs)
+
+
+def work_buffers(nx):
+    '''The work arrays of flux_kernel, allocated once per run; nx can also be a shape [nmembers, nx].'''
+    return {name: np.zeros(nx) for name in ['h', 'hsq', 'h3', 'h5', 'dhdx3', 'avg', 'tmp', 'smbdt']}
+
+
+def flux_kernel(hice,bedrock,dx,dhdx,fluxd,fluxs,dhdtif,work,FluxAtPoints=True,dxcell=None):
+    '''
+    Fluxes and flux convergence of icemodel (the same equations), computed in place:
+    all intermediate results go to the preallocated work arrays (see work_buffers), so no
+    temporary arrays are made. hice**5 is computed as hice**3 * hice**2.
+    Because of that the result is not bit for bit the same as the normal path (relative
+    differences of order 1e-15).
+    IN:
+    hice, bedrock = arrays [nx], or hice [nmembers, nx] for icemodel_ensemble
+    dhdx, fluxd, fluxs, dhdtif = arrays of icemodel, these are overwritten
+    work          = dict from work_buffers(nx)
+    dxcell        = for a non-uniform grid (only FluxAtPoints=False) the cell widths [nx],
+                    dx are then the distances between the points [nx-1]
+    OUT:
+    the surface height hice + bedrock (work['h'])
+    '''
+    h, hsq, h3, h5 = work['h'], work['hsq'], work['h3'], work['h5']
+    dhdx3, avg, tmp = work['dhdx3'], work['avg'], work['tmp']
+    np.add(hice, bedrock, out=h)
+    np.multiply(hice, hice, out=hsq)
+    np.multiply(hsq, hice, out=h3)
+    np.multiply(h3, hsq, out=h5)
+    if FluxAtPoints:
+        np.subtract(h[...,2:], h[...,:-2], out=dhdx[...,1:-1])
+        np.divide(dhdx[...,1:-1], 2*dx, out=dhdx[...,1:-1])
+        np.multiply(dhdx, dhdx, out=dhdx3)
+        np.multiply(dhdx3, dhdx, out=dhdx3)
+
+        # note that flux[1] is at the point 0
+        np.multiply(dhdx3, cd, out=tmp)
+        np.multiply(tmp, h5, out=fluxd[...,1:-1])
+        np.multiply(dhdx3, cs, out=tmp)
+        np.multiply(tmp, h3, out=fluxs[...,1:-1])
+
+        # derive flux convergence
+        np.subtract(fluxd[...,2:], fluxd[...,:-2], out=dhdtif)
+        np.add(dhdtif, fluxs[...,2:], out=dhdtif)
+        np.subtract(dhdtif, fluxs[...,:-2], out=dhdtif)
+        np.divide(dhdtif, 2*dx, out=dhdtif)
+    else:
+        np.subtract(h[...,1:], h[...,:-1], out=dhdx[...,:-1])
+        np.divide(dhdx[...,:-1], dx, out=dhdx[...,:-1]) # so 0 is at 1/2 actually
+        np.multiply(dhdx[...,:-1], dhdx[...,:-1], out=dhdx3[...,:-1])
+        np.multiply(dhdx3[...,:-1], dhdx[...,:-1], out=dhdx3[...,:-1])
+
+        # note that flux[1] is at the point 1/2
+        np.multiply(dhdx3[...,:-1], cd, out=tmp[...,:-1])
+        np.add(h5[...,1:], h5[...,:-1], out=avg[...,:-1])
+        np.multiply(avg[...,:-1], 0.5, out=avg[...,:-1])
+        np.multiply(tmp[...,:-1], avg[...,:-1], out=fluxd[...,1:-2])
+        np.multiply(dhdx3[...,:-1], cs, out=tmp[...,:-1])
+        np.add(h3[...,1:], h3[...,:-1], out=avg[...,:-1])
+        np.multiply(avg[...,:-1], 0.5, out=avg[...,:-1])
+        np.multiply(tmp[...,:-1], avg[...,:-1], out=fluxs[...,1:-2])
+
+        # derive flux convergence
+        np.subtract(fluxd[...,1:-1], fluxd[...,:-2], out=dhdtif)
+        np.add(dhdtif, fluxs[...,1:-1], out=dhdtif)
+        np.subtract(dhdtif, fluxs[...,:-2], out=dhdtif)
+        np.divide(dhdtif, dx if dxcell is None else dxcell, out=dhdtif)
+    return h
+
+
+def benchmark_kernel(nxlist=[10, 25, 50, 100, 200, 400], nyear=50, ela=1800., FluxAtPoints=True):
+    '''
+    Micro-benchmark of the time step of icemodel: steps per second of the normal path and of
+    FastKernel=True, for a 20 km domain with nx points, and the largest relative difference
+    in the final ice thickness between the two.
+    OUT:
+    dict with arrays nx, normal, fast (steps per second) and reldiff
+    '''
+    results = {'nx': np.array(nxlist), 'normal': np.zeros(len(nxlist)),
+               'fast': np.zeros(len(nxlist)), 'reldiff': np.zeros(len(nxlist))}
+    print('   nx   normal [steps/s]   fast [steps/s]   speedup   max rel. diff')
+    for i, nx in enumerate(nxlist):
+        hice = {}
+        for path in ['normal', 'fast']:
+            tstart = time.perf_counter()
+            model  = icemodel([ela], [nyear], dx=20000/nx, FluxAtPoints=FluxAtPoints,
+                              FastKernel=(path == 'fast'), render=False)
+            results[path][i] = model['nsteps']/(time.perf_counter() - tstart)
+            hice[path] = model['hice']
+        results['reldiff'][i] = np.max(np.abs(hice['fast'] - hice['normal']))/max(np.max(hice['normal']), 1.)
+        print('{0:5d}  {1:17.0f}  {2:15.0f}  {3:8.2f}  {4:14.1e}'.format(nx, results['normal'][i],
+              results['fast'][i], results['fast'][i]/results['normal'][i], results['reldiff'][i]))
+    return results
+
+
+def icemodel_ensemble(elalist,elayear,totL=20000,dx=100,ntpy=200,ZeroFluxBoundary=True,FluxAtPoints=True,ndyfigure=5,dbdh=0.007, maxb=2, initial_state=None):
+    '''
+    Same model as icemodel, but for many ela histories (members) at once.
+    All members are advanced together in one time loop on an [nmembers, nx] array,
+    so the python overhead of the time loop is only paid once. The time step is done in
+    place in preallocated arrays (see flux_kernel), so the results are the same as those
+    of icemodel(FastKernel=True).
+    IN:
+    elalist       = array [nmembers, nela], the ela history of each member.
+                    A 1D array is read as one ela per member (nela=1).
+    elayear       = array [nela], years per ela, shared by all members
+    dbdh, maxb    = scalar or array [nmembers]
+    initial_state = None, one returndict of icemodel used for all members,
+                    or a list with one returndict per member
+    OUT:
+    returndict with the same entries as icemodel, but with an extra first axis
+    for the members. Use ensemble_member to get the returndict of one member.
+    No animation or plot is made.
+    '''
+    StopWhenOutOfDomain = True
+
+    if dx == 50:
+        ntpy = ntpy*8
+
+    elalist = np.array(elalist, dtype=float)
+    if elalist.ndim == 1:
+        elalist = elalist[:,None]
+    nmem, nela = np.shape(elalist)
+    elayear = np.atleast_1d(elayear)
+    assert nela == np.size(elayear), "the arrays of elalist and elayear does not have the same length!"
+
+    dbdh = np.broadcast_to(np.asarray(dbdh, dtype=float), [nmem])[:,None]
+    maxb = np.broadcast_to(np.asarray(maxb, dtype=float), [nmem])[:,None]
+
+    nx    = int(totL/dx)
+    dx    = totL/nx
+    xaxis = np.linspace(0,totL,nx,False) + dx*0.5
+
+    bedrock = get_bedrock(xaxis)
+
+    dt    = 365.*86400./ntpy # in seconds!
+
+    if initial_state is None:
+        hice   = np.zeros([nmem,nx])    # ice thickness
+        dhdx   = np.zeros([nmem,nx])    # the local gradient of h
+        fluxd  = np.zeros([nmem,nx+2])  # this will be the flux per second!!!!
+        fluxs  = np.zeros([nmem,nx+2])  # this will be the flux per second!!!!
+        dhdtif = np.zeros([nmem,nx])    # change in ice thickness due to the ice flux, per second
+        smb    = np.zeros([nmem,nx])
+    else:
+        if isinstance(initial_state, dict):
+            initial_state = [initial_state]*nmem
+        assert len(initial_state) == nmem, 'give one initial state, or one per member!'
+        for state in initial_state:
+            assert nx == state['nx'], 'nx input and initial state should match!'
+            assert ntpy == state['ntpy'], 'ntpy input and initial state should match!'
+        # np.array makes copies, so the initial states are not changed
+        hice   = np.array([state['hice'] for state in initial_state], dtype=float)
+        dhdx   = np.array([state['dhdx'] for state in initial_state], dtype=float)
+        fluxd  = np.array([state['fluxd'] for state in initial_state], dtype=float)
+        fluxs  = np.array([state['fluxs'] for state in initial_state], dtype=float)
+        dhdtif = np.array([state['dhdtif'] for state in initial_state], dtype=float)
+        smb    = np.array([state['smb'] for state in initial_state], dtype=float)
+
+    # preparations for the ela-selection
+    # elaswch is a list of years on which a new ela value should be used, as in icemodel.
+    nyear    = int(np.sum(elayear))
+    elaswch = np.zeros(nela)
+    for i in range(0,nela-1):
+        elaswch[i+1] = elaswch[i] + elayear[i]
+    ela     = elalist[:,0]
+
+    # preparations for the animation frames
+    nframes  = nyear//ndyfigure + 1
+    hsurfmem = np.zeros([nmem,nx,nframes])
+    smbmem   = np.zeros([nmem,nx,nframes])
+    ifdmem   = np.zeros([nmem,nx,nframes])
+    fldmem   = np.zeros([nmem,nx-1,nframes])
+    flsmem   = np.zeros([nmem,nx-1,nframes])
+    iframes  = 0
+
+    # preparations for response time calculations
+    lengthmem = np.zeros([nmem,nyear+1])
+    volumemem = np.zeros([nmem,nyear+1])
+    elamemory = np.zeros([nmem,nyear+1])
+    yearlist  = np.arange(nyear+1)
+
+    # (re)set initial values so that the accumulation area has glacier right away.
+    hice = np.where(bedrock>ela[:,None], np.where(hice<0.11, 0.11, hice), hice)
+
+    lengthmem[:,0] = np.sum(np.where(hice>0.1, dx, 0.), axis=1)
+    volumemem[:,0] = np.sum(hice, axis=1)*dx
+    elamemory[:,0] = ela
+
+    # members that stopped (NaN or ice at end of domain) are still computed,
+    # but their bookkeeping is frozen and their final state is kept aside.
+    active = np.ones(nmem, dtype=bool)
+    final  = {}
+
+    def stop_members(stopped):
+        for im in np.nonzero(stopped)[0]:
+            final[im] = [hice[im].copy(), dhdx[im].copy(), fluxd[im].copy(),
+                         fluxs[im].copy(), dhdtif[im].copy(), smb[im].copy()]
+        active[stopped] = False
+
+    #0-----------------------------------------------------------------------------
+    print("Run model for {0:3d} years and {1:3d} members".format(nyear, nmem))
+
+    work  = work_buffers([nmem,nx])
+    smbdt = work['smbdt']
+    with np.errstate(over='ignore', invalid='ignore'):
+        for it in range(1, ntpy*nyear+1):
+            h = flux_kernel(hice, bedrock, dx, dhdx, fluxd, fluxs, dhdtif, work, FluxAtPoints)
+
+            # calculate smb (per year)
+            # first update ela (once a year)
+            if (it-1)%ntpy == 0:
+                # lists the elements of elaswch that are equal or smaller than the number of completed years
+                iy        = (it-1)//ntpy
+                [ielanow] = np.nonzero(elaswch<=iy)
+                # the last one is the current ela
+                ela       = elalist[:,ielanow[-1]]
+
+            np.subtract(h, ela[:,None], out=smb)
+            np.multiply(smb, dbdh, out=smb)
+            np.minimum(smb, maxb, out=smb)
+
+            np.divide(smb, ntpy, out=smbdt)
+            np.multiply(dhdtif, dt, out=work['tmp'])
+            np.add(smbdt, work['tmp'], out=work['tmp'])
+            np.add(hice, work['tmp'], out=hice)
+            np.maximum(hice, 0., out=hice) # remove negative ice thicknesses
+
+            if ZeroFluxBoundary == False:
+                hice[:,0] = hice[:,-1] = 0.
+
+            if it%ntpy == 0:
+                gotnan = active & np.any(np.isnan(hice), axis=1)
+                if np.any(gotnan):
+                    print('Values got NaN for member(s) {}!'.format(np.nonzero(gotnan)[0]))
+                    stop_members(gotnan)
+                iy = it//ntpy
+                lengthmem[active,iy] = np.sum(np.where(hice[active]>0.1, dx, 0.), axis=1)
+                volumemem[active,iy] = np.sum(hice[active], axis=1)*dx
+                elamemory[active,iy] = ela[active]
+
+            if it%(ndyfigure*ntpy) == 0:
+                iframes                    += 1
+                hsurfmem[active,:,iframes] = hice[active] + bedrock
+                smbmem[active,:,iframes]   = smb[active]
+                ifdmem[active,:,iframes]   = dhdtif[active]*365.*86400.
+                fldmem[active,:,iframes]   = -fluxd[active,1:-2]*365.*86400.
+                flsmem[active,:,iframes]   = -fluxs[active,1:-2]*365.*86400.
+                if StopWhenOutOfDomain:
+                    outofdomain = active & (hice[:,-1]>1.)
+                    if np.any(outofdomain):
+                        print("Ice at end of domain for member(s) {}!".format(np.nonzero(outofdomain)[0]))
+                        stop_members(outofdomain)
+
+            if not np.any(active):
+                break
+
+    # put back the state of the members at the moment they stopped
+    for im, (hicem, dhdxm, fluxdm, fluxsm, dhdtifm, smbm) in final.items():
+        hice[im], dhdx[im], fluxd[im], fluxs[im], dhdtif[im], smb[im] = hicem, dhdxm, fluxdm, fluxsm, dhdtifm, smbm
+
+    returndict = {
+        'nmembers': nmem,
+        'nx': nx,
+        'ntpy':ntpy,
+        'dx':dx,
+        'totL':totL,
+        'ndyfigure':ndyfigure,
+        'years':yearlist,
+        'Glacier Length':lengthmem,
+        'Glacier Volume':volumemem,
+        'Glacier ELA':elamemory,
+        'Glacier Height':hsurfmem,
+        'Surface Mass Balance': smbmem,
+        'ifd':ifdmem,
+        'fld':fldmem,
+        'fls':flsmem,
+        'hice':hice,
+        'dhdx':dhdx,
+        'fluxd':fluxd,
+        'fluxs':fluxs,
+        'dhdtif':dhdtif,
+        'smb':smb,
+        'Bedrock': bedrock,
+    }
+    return returndict
+
+
+def ensemble_member(ensdict, imember):
+    '''
+    Get the returndict of one member of icemodel_ensemble, in the same form as
+    the returndict of icemodel (so it can be used for the postprocessing or as initial_state).
+    '''
+    shared = ['nmembers', 'nx', 'ntpy', 'dx', 'totL', 'ndyfigure', 'years', 'Bedrock']
+    returndict = {key: value[imember] for key, value in ensdict.items() if key not in shared}
+    for key in shared[1:]:
+        returndict[key] = ensdict[key]
+    return returndict
+
+
+def compute_response_time(diction, avgperiode=10, drift=None):
+    glacier_length = np.array(diction['Glacier Length'])
+    if drift is not None:
+         glacier_length = glacier_length - np.array(drift['Glacier Length'])
+    yearls = np.array(diction['years'])
+    end_len = np.mean(glacier_length[-avgperiode:])
+    start_len = glacier_length[0]
+    threshold = start_len + (end_len - start_len) * (1 - 1/np.e)
+    if glacier_length[0] < glacier_length[-1]: # glacier grows
+        response_idx = np.argmax(glacier_length > threshold)
+    else: # glacier shrinks
+        response_idx = np.argmax(glacier_length < threshold)
+    return yearls[response_idx]
+
+
+def compute_mass_change(diction, avgperiode=10, drift=None):
+    if drift is not None:
+        volume = np.array(diction['Glacier Volume']) - np.array(drift['Glacier Volume'])
+    else:
+        volume = np.array(diction['Glacier Volume']) 
+    mass_begin = volume[0] * rho
+    mass_end = np.mean(volume[-avgperiode:]) * rho
+    mass_change = mass_end - mass_begin
+    return mass_change
+
+
+def avg_smb(diction, avgperiod=1):
+    '''calculate integrated surface mass balance at end of simulation
+    (the mean over the ice-covered cells, weighted with the cell widths on a non-uniform grid)'''
+    smb = diction['Surface Mass Balance']
+    glacier_len = diction['Glacier Length'][-1]
+    if 'Grid' in diction:
+        # the glacier covers the cells whose right face lies within its length
+        dxcell  = np.diff(diction['Grid'])
+        idx     = int(np.searchsorted(diction['Grid'][1:], glacier_len + 0.5*np.min(dxcell)))
+        smb_int = np.mean(np.sum(smb[:idx, -avgperiod:]*dxcell[:idx,None], axis=0) / np.sum(dxcell[:idx]))
+        return smb_int
+    idx = int(glacier_len / diction['dx'])
+    smb_int = np.mean(smb[:idx, -avgperiod:])
+    return smb_int
+
+
+def save_state(results, filename, diagnostics=False):
+    '''
+    Save the state of an icemodel run in the savestate format (uncompressed numpy .npz).
+    The prognostic state, needed to restart, goes to filename.npz, together with a small
+    metadata header (format version and the scalars of the returndict) and the non-uniform grid, if any.
+    With diagnostics=True, all other arrays (time series and frames) go to filename_diag.npz.
+    '''
+    filename = filename[:-4] if filename.endswith('.npz') else filename
+    metadata = {'savestate_version': savestate_version}
+    arrays   = {}
+    for key, value in results.items():
+        if isinstance(value, np.ndarray):
+            arrays[key] = value
+        else:
+            metadata[key] = value.item() if isinstance(value, np.generic) else value
+
+    statekeys = prognostic_keys + [key for key in ['Grid'] if key in arrays]
+    np.savez(filename + '.npz', metadata=json.dumps(metadata),
+             **{key: arrays[key] for key in statekeys})
+    if diagnostics:
+        np.savez(filename + '_diag.npz',
+                 **{key: value for key, value in arrays.items() if key not in statekeys})
+
+
+def load_state(filename, diagnostics=False):
+    '''
+    Load a state saved by save_state. Only the prognostic state is read, unless diagnostics=True.
+    The result can be used as initial_state of icemodel.
+    '''
+    filename = filename[:-4] if filename.endswith('.npz') else filename
+    with np.load(filename + '.npz') as data:
+        state = json.loads(str(data['metadata']))
+        if state['savestate_version'] > savestate_version:
+            raise ValueError("Savestate {0:s} has version {1:d}, only up to {2:d} can be read.".format(
+                             filename, state['savestate_version'], savestate_version))
+        for key in prognostic_keys:
+            state[key] = data[key]
+        if 'Grid' in data.files:
+            state['Grid'] = data['Grid']
+    if diagnostics:
+        with np.load(filename + '_diag.npz') as data:
+            for key in data.files:
+                state[key] = data[key]
+    return state
+
+
+def convert_savestates(savestatedir=os.path.join('..', 'Savestates'), diagnostics=False):
+    '''Write every pickled savestate (.pkl) in savestatedir also in the savestate format.'''
+    for name in sorted(os.listdir(savestatedir)):
+        if name.endswith('.pkl'):
+            with open(os.path.join(savestatedir, name), 'rb') as f:
+                results = pickle.load(f)
+            save_state(results, os.path.join(savestatedir, name[:-4]), diagnostics=diagnostics)
+            print("Converted "+name)
+
+
+def load_initial_state(ela_initial, dx_initial, elayear_initial, savestatedir=os.path.join('..', 'Savestates')):
+    initial_name = f'initial_{ela_initial}m_{dx_initial}m_{elayear_initial}a'
+    npzload = os.path.join(savestatedir, f'{initial_name}.npz')
+    if os.path.isfile(npzload):
+        return load_state(npzload), initial_name
+    # old format, the full pickled returndict
+    pklload = os.path.join(savestatedir, f'{initial_name}.pkl')
+    with open(pklload, 'rb') as f:
+        loaded_initial = pickle.load(f)
+    return loaded_initial, initial_name
+
+
+def sweep_run(ela, elayear, dx, ela_initial, elayear_initial, savestatedir, cachedir, modelkwargs):
+    '''One run of run_sweep. Only the parts needed for the postprocessing are given back.'''
+    initial_state, initial_name = load_initial_state(ela_initial, dx, elayear_initial, savestatedir)
+    model = cached_icemodel([ela], [elayear], cachedir=cachedir, dx=dx, initial_state=initial_state, **modelkwargs)
+    result = {
+        'Stop reason': model['Stop reason'],
+        'dx': model['dx'],
+        'years': model['years'],
+        'Glacier Length': model['Glacier Length'],
+        'Glacier Volume': model['Glacier Volume'],
+        'Surface Mass Balance': model['Surface Mass Balance'][:,-1:], # avg_smb uses the last frame
+    }
+    if 'Grid' in model:
+        result['Grid'] = model['Grid']
+    return result
+
+
+def run_sweep(ela_initial_arr, ela2test, dx_arr, elayear_arr, elayear_initial=1000, nworkers=None,
+              savestatedir=os.path.join('..', 'Savestates'), cachedir=None, **modelkwargs):
+    '''
+    Run all combinations of initial ela, test ela, dx and elayear in parallel processes,
+    and collect response time, mass change and average smb (relative to the drift run).
+    IN:
+    ela_initial_arr = initial elas, the initial states are read from savestatedir
+    ela2test        = test elas
+    dx_arr          = grid sizes
+    elayear_arr     = durations of the test runs
+    elayear_initial = duration of the spin-up, used to find the initial states
+    nworkers        = number of processes, default is the number of cores
+    cachedir        = if given, runs are looked up in / stored in this result cache (see cached_icemodel)
+    modelkwargs     = passed on to icemodel (default FluxAtPoints=False and render=False)
+    OUT:
+    table, dictionary with one array per column and one row per combination:
+    'ela_initial', 'ela_test', 'dela', 'dx', 'elayear', 'response_time', 'mass_change', 'avg_smb', 'status'
+    A run that failed (or its drift run) gets NaN values and the reason in 'status'.
+    '''
+    modelkwargs.setdefault('FluxAtPoints', False)
+    modelkwargs.setdefault('render', False)
+
+    # the drift run is the run with the test ela equal to the initial ela
+    rows = [(ela_initial, ela, dx, elayear) for ela_initial in ela_initial_arr for dx in dx_arr
+            for elayear in elayear_arr for ela in ela2test]
+    runs = set(rows) | set((ela_initial, ela_initial, dx, elayear) for ela_initial, ela, dx, elayear in rows)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        futures = {pool.submit(sweep_run, ela, elayear, dx, ela_initial, elayear_initial, savestatedir, cachedir, modelkwargs):
+                   (ela_initial, ela, dx, elayear) for ela_initial, ela, dx, elayear in runs}
+        for ndone, future in enumerate(as_completed(futures), 1):
+            run = futures[future]
+            try:
+                results[run] = future.result()
+            except Exception as err:
+                results[run] = {'Stop reason': f'error: {err}'}
+            if results[run]['Stop reason'] is not None:
+                print("Run ela={1}m dx={2}m {3}a from initial ela={0}m failed: {4}".format(*run, results[run]['Stop reason']))
+            print("Sweep: {0:4d}/{1:4d} runs done".format(ndone, len(futures)))
+
+    nrow  = len(rows)
+    table = {
+        'ela_initial': np.array([row[0] for row in rows]),
+        'ela_test': np.array([row[1] for row in rows]),
+        'dela': np.array([row[1]-row[0] for row in rows]),
+        'dx': np.array([row[2] for row in rows]),
+        'elayear': np.array([row[3] for row in rows]),
+        'response_time': np.full(nrow, np.nan),
+        'mass_change': np.full(nrow, np.nan),
+        'avg_smb': np.full(nrow, np.nan),
+        'status': np.full(nrow, 'ok', dtype=object),
+    }
+    for irow, (ela_initial, ela, dx, elayear) in enumerate(rows):
+        model = results[(ela_initial, ela, dx, elayear)]
+        drift = results[(ela_initial, ela_initial, dx, elayear)]
+        if model['Stop reason'] is not None:
+            table['status'][irow] = model['Stop reason']
+        elif drift['Stop reason'] is not None:
+            table['status'][irow] = 'drift: ' + drift['Stop reason']
+        else:
+            table['response_time'][irow] = compute_response_time(model, drift=drift)
+            table['mass_change'][irow]   = compute_mass_change(model, drift=drift)
+            table['avg_smb'][irow]       = avg_smb(model)
+    return table
+
+
+def fingerprint(obj, hasher=None):
+    '''
+    Hash of (nested) dicts, lists, arrays and scalars, used as key for the result cache.
+    Numbers are hashed by value, so 1600, 1600. and np.int64(1600) give the same hash.
+    '''
+    if hasher is None:
+        hasher = hashlib.sha1()
+    if isinstance(obj, dict):
+        hasher.update(b'dict')
+        for key in sorted(obj):
+            hasher.update(repr(key).encode())
+            fingerprint(obj[key], hasher)
+    elif isinstance(obj, (list, tuple, np.ndarray)):
+        arr = np.asarray(obj)
+        if arr.dtype.kind in 'biuf':
+            arr = arr.astype(float)
+        hasher.update(repr((arr.dtype.str, arr.shape)).encode())
+        hasher.update(np.ascontiguousarray(arr).tobytes() if arr.dtype.kind != 'O' else repr(arr.tolist()).encode())
+    elif isinstance(obj, (bool, np.bool_)) or obj is None or isinstance(obj, str):
+        hasher.update(repr(obj).encode())
+    else:
+        hasher.update(repr(float(obj)).encode())
+    return hasher.hexdigest()
+
+
+def cache_key(elalist, elayear, **kwargs):
+    '''The cache key of an icemodel run: a hash of all inputs that change the result.'''
+    arguments = inspect.signature(icemodel).bind(elalist, elayear, **kwargs)
+    arguments.apply_defaults()
+    inputs = dict(arguments.arguments)
+    # these only change the figures (or the timing), not the result
+    del inputs['savename'], inputs['render'], inputs['sink'], inputs['timers']
+    # the bedrock profile (and so its slope) is part of the input
+    nx = int(inputs['totL']/inputs['dx'])
+    dx = inputs['totL']/nx
+    inputs['bedrock'] = get_bedrock(np.linspace(0,inputs['totL'],nx,False) + dx*0.5)
+    # only the prognostic part of the initial state matters
+    if inputs['initial_state'] is not None:
+        inputs['initial_state'] = {key: inputs['initial_state'][key] for key in
+                                   ['nx', 'ntpy', 'hice', 'dhdx', 'fluxd', 'fluxs', 'dhdtif', 'smb', 'Grid']
+                                   if key in inputs['initial_state']}
+    inputs['cache_version'] = cache_version
+    return fingerprint(inputs)
+
+
+def cache_evict(cachedir, maxsize):
+    '''Remove the least recently used results until the cache is smaller than maxsize (bytes).'''
+    files = [os.path.join(cachedir, name) for name in os.listdir(cachedir) if name.endswith('.pkl')]
+    stats = []
+    for name in files:
+        try:
+            stats.append((os.stat(name).st_mtime, os.stat(name).st_size, name))
+        except FileNotFoundError: # removed by another process
+            pass
+    total = sum(size for mtime, size, name in stats)
+    for mtime, size, name in sorted(stats):
+        if total <= maxsize:
+            break
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cached_icemodel(elalist, elayear, cachedir=os.path.join('..', 'Cache'), maxsize=2e9, **kwargs):
+    '''
+    icemodel, but the result is looked up in (and stored in) an on-disk cache first.
+    The key is a hash of all inputs, including the bedrock and the initial state.
+    When the cache is larger than maxsize bytes, the least recently used results are removed.
+    With cachedir=None, or with a sink given, this is just icemodel.
+    The animation (if render is not False) is made from the (cached) result.
+    '''
+    if cachedir is None or kwargs.get('sink') is not None:
+        return icemodel(elalist, elayear, **kwargs)
+
+    render   = kwargs.pop('render', True)
+    savename = kwargs.pop('savename', None)
+    os.makedirs(cachedir, exist_ok=True)
+    filename = os.path.join(cachedir, cache_key(elalist, elayear, **kwargs) + '.pkl')
+
+    try:
+        with open(filename, 'rb') as f:
+            results = pickle.load(f)
+        os.utime(filename) # mark as recently used
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        results = icemodel(elalist, elayear, render=False, **kwargs)
+        # write to a temporary file first, so that parallel runs never see half a file
+        tmpname = f'{filename}.{os.getpid()}.tmp'
+        with open(tmpname, 'wb') as f:
+            pickle.dump(results, f)
+        os.replace(tmpname, filename)
+        cache_evict(cachedir, maxsize)
+
+    if render:
+        render_icemodel(results, savename=savename)
+    return results
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the flowline model: time steps per second of icemodel for a range of dx and ntpy,
+the wall time of a spin-up with the time per phase (see PhaseTimer), and the throughput of run_sweep.
+
+Example:
+    python benchmark_icemodel.py --dx 2000 1000 500 200 100 --ntpy 200 400 --output benchmark_icemodel.json
+The results are written as JSON. Runs that stopped early (NaN, out of domain) are reported
+with their stop reason, their steps per second are still valid.
+"""
+
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import numpy as np
+import FlowModel_functions as fm
+
+
+def timed_icemodel(elalist, elayear, verbose=False, **kwargs):
+    '''icemodel without figures, returns the wall time and the result'''
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        tstart = time.perf_counter()
+        model  = fm.icemodel(elalist, elayear, render=False, **kwargs)
+        return time.perf_counter() - tstart, model
+
+
+def benchmark_steps(dxlist, ntpylist, nyear, ela, repeat, kernels, verbose=False):
+    '''time steps per second (best of repeat) for each kernel, dx and ntpy'''
+    results = []
+    print('   dx   ntpy  kernel      steps/s   stop reason')
+    for kernel in kernels:
+        for dx in dxlist:
+            for ntpy in ntpylist:
+                seconds = []
+                for irepeat in range(repeat):
+                    wall, model = timed_icemodel([ela], [nyear], verbose, dx=dx, ntpy=ntpy, FastKernel=(kernel == 'fast'))
+                    seconds.append(wall)
+                result = {'kernel': kernel, 'dx': dx, 'ntpy': ntpy, 'nx': model['nx'], 'nyear': nyear,
+                          'nsteps': model['nsteps'], 'seconds': seconds, 'min': min(seconds),
+                          'steps_per_second': model['nsteps']/min(seconds),
+                          'stop_reason': model['Stop reason']}
+                results.append(result)
+                print('{0:5g}  {1:5d}  {2:6s}  {3:11.0f}   {4}'.format(dx, ntpy, kernel, result['steps_per_second'],
+                      result['stop_reason']))
+    return results
+
+
+def benchmark_spinup(dx, nyear, ela, render=False, plotdir=None, verbose=False):
+    '''one spin-up from an empty domain, with the time per phase, optionally with rendering.
+    As the state is the start of the sweep, it has the settings of run_sweep (FluxAtPoints=False, default ntpy).'''
+    timers = fm.PhaseTimer()
+    wall, model = timed_icemodel([ela], [nyear], verbose, dx=dx, FluxAtPoints=False, timers=timers)
+    result = {'dx': dx, 'ntpy': model['ntpy'], 'nx': model['nx'], 'nyear': nyear, 'nsteps': model['nsteps'],
+              'seconds': wall, 'steps_per_second': model['nsteps']/wall, 'stop_reason': model['Stop reason']}
+    if render:
+        timers.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fm.render_icemodel(model, savename='benchmark', plotdir=plotdir)
+        timers.lap('render')
+    result['phases'] = timers.report()
+    return result, model
+
+
+def benchmark_sweep(model, ela_initial, dx, nyear_initial, ela2test, nyear, nworkers, savestatedir, verbose=False):
+    '''run_sweep from the spin-up state, in runs per second (drift runs included)'''
+    fm.save_state(model, os.path.join(savestatedir, f'initial_{ela_initial}m_{dx}m_{nyear_initial}a'))
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        tstart = time.perf_counter()
+        table  = fm.run_sweep([ela_initial], ela2test, [dx], [nyear], elayear_initial=nyear_initial,
+                              nworkers=nworkers, savestatedir=savestatedir)
+        wall   = time.perf_counter() - tstart
+    nruns = len(set(ela2test) | {ela_initial})
+    return {'ela_initial': ela_initial, 'ela_test': list(ela2test), 'dx': dx, 'nyear': nyear,
+            'nworkers': nworkers if nworkers is not None else os.cpu_count(), 'runs': nruns,
+            'seconds': wall, 'runs_per_second': nruns/wall, 'status': list(table['status'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of icemodel, its spin-up and run_sweep.')
+    parser.add_argument('--dx', type=float, nargs='+', default=[2000., 1000., 500., 200., 100.], help='grid sizes for the steps per second (m)')
+    parser.add_argument('--ntpy', type=int, nargs='+', default=[200, 400], help='time steps per year for the steps per second')
+    parser.add_argument('--years', type=int, default=20, help='years per run for the steps per second (default 20)')
+    parser.add_argument('--kernels', nargs='+', choices=['normal', 'fast'], default=['normal', 'fast'],
+                        help='the normal path and/or FastKernel=True (default both)')
+    parser.add_argument('--ela', type=float, default=1600., help='ela of the runs (default 1600 m)')
+    parser.add_argument('--repeat', type=int, default=1, help='repetitions of the steps per second runs, the best is used (default 1)')
+    parser.add_argument('--spinup-dx', type=int, default=100, help='grid size of the spin-up and the sweep (default 100 m)')
+    parser.add_argument('--spinup-years', type=int, default=200, help='length of the spin-up (default 200 years)')
+    parser.add_argument('--render', action='store_true', help='include the rendering of the spin-up in its phases')
+    parser.add_argument('--sweep-elas', type=float, nargs='*', default=[1500., 1550., 1650., 1700.],
+                        help='test elas of the sweep, none skips the sweep (default 1500 1550 1650 1700)')
+    parser.add_argument('--sweep-years', type=int, default=100, help='length of the sweep runs (default 100 years)')
+    parser.add_argument('--nworkers', type=int, default=None, help='processes of the sweep (default the number of cores)')
+    parser.add_argument('--output', default='benchmark_icemodel.json', help='JSON file with the results (default benchmark_icemodel.json)')
+    parser.add_argument('--verbose', action='store_true', help='show the output of icemodel')
+    args = parser.parse_args()
+
+    output = {'benchmark': 'icemodel', 'date': dt.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'arguments': vars(args), 'results': {}}
+
+    print('Steps per second')
+    output['results']['steps'] = benchmark_steps(args.dx, args.ntpy, args.years, args.ela, args.repeat, args.kernels, args.verbose)
+
+    workdir = tempfile.mkdtemp(prefix='benchmark_icemodel_')
+    try:
+        print('Spin-up of {0:d} years, dx={1:d} m'.format(args.spinup_years, args.spinup_dx))
+        output['results']['spinup'], model = benchmark_spinup(args.spinup_dx, args.spinup_years, args.ela,
+                                                               args.render, workdir, args.verbose)
+        print('  {0:.2f} s'.format(output['results']['spinup']['seconds']))
+        if args.sweep_elas:
+            print('Sweep of {0:d} runs of {1:d} years'.format(len(set(args.sweep_elas) | {args.ela}), args.sweep_years))
+            output['results']['sweep'] = benchmark_sweep(model, args.ela, args.spinup_dx, args.spinup_years, args.sweep_elas,
+                                                         args.sweep_years, args.nworkers, workdir, args.verbose)
+            print('  {0:.2f} runs per second'.format(output['results']['sweep']['runs_per_second']))
+    finally:
+        shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+    print('Results written to ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of FlowModel_functions, run with: python -m pytest Project_1/Code
+"""
+
+import contextlib
+import io
+import numpy as np
+import FlowModel_functions as fm
+
+
+def quiet_icemodel(elalist, elayear, **kwargs):
+    '''icemodel without figures and without its output'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fm.icemodel(elalist, elayear, render=False, **kwargs)
+
+
+def quiet_icemodel_ensemble(elalist, elayear, **kwargs):
+    '''icemodel_ensemble without its output'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fm.icemodel_ensemble(elalist, elayear, **kwargs)
+
+
+def test_avg_smb_is_weighted_with_the_cell_widths():
+    # an smb that is linear in x: the mean over the glacier is the value halfway its length,
+    # on any grid that has a face at the end of the glacier
+    length  = 10000.
+    uniform = np.linspace(0., 20000., 41)
+    refined = np.concatenate([np.linspace(0., 8000., 17), np.linspace(8000., 12000., 81)[1:],
+                              np.linspace(12000., 20000., 17)[1:]])
+    expected = 0.001*(0.5*length - 6000.)
+    results  = []
+    for faces, extra in [(uniform, {'dx': 500.}), (refined, {'Grid': refined})]:
+        xaxis = (faces[1:] + faces[:-1])*0.5
+        smb   = np.tile(0.001*(xaxis - 6000.)[:,None], (1, 3))
+        diction = {'Surface Mass Balance': smb, 'Glacier Length': np.array([length])}
+        diction.update(extra)
+        results.append(fm.avg_smb(diction))
+    assert np.allclose(results, expected)
+
+
+def test_avg_smb_of_refined_and_uniform_grid_agree():
+    uniform = quiet_icemodel([1600.], [200], dx=500, FluxAtPoints=False, adaptive=True)
+    length  = uniform['Glacier Length'][-1]
+    refined = quiet_icemodel([1600.], [200], FluxAtPoints=False, adaptive=True,
+                             grid=fm.refined_grid(20000, 100, 500, [length], width=1000))
+    assert np.isclose(refined['Glacier Length'][-1], length)
+    assert abs(fm.avg_smb(refined) - fm.avg_smb(uniform)) < 0.05
+
+
+def test_steady_state_run_returns_all_frames():
+    model = quiet_icemodel([1600.], [1000], dx=500, FluxAtPoints=False, steadytol=1e-4)
+    assert model['Steady year'] is not None and model['Steady year'] < 1000
+    assert model['iframes'] == 1000//model['ndyfigure']
+    # the frames after the steady state hold the final state
+    assert np.array_equal(model['Glacier Height'][:,-1], model['hice'] + model['Bedrock'])
+
+
+def test_ensemble_members_equal_icemodel():
+    elalist = np.array([[1600., 1800.], [1700., 1500.]])
+    for ntpy in [1, 50]:
+        ensemble = quiet_icemodel_ensemble(elalist, [5, 5], dx=1000, ntpy=ntpy)
+        for imember in range(2):
+            member = fm.ensemble_member(ensemble, imember)
+            model  = quiet_icemodel(list(elalist[imember]), [5, 5], dx=1000, ntpy=ntpy, FastKernel=True)
+            for key in ['Glacier ELA', 'Glacier Volume', 'Glacier Height', 'hice']:
+                assert np.array_equal(member[key], model[key])
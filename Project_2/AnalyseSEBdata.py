@@ -12,20 +12,23 @@ import SEB_functions as SEBf
 import matplotlib.pyplot as plt
 
 station = "S10"
+# only these variables are used below (and by Correct_Gs_S6), the others are not kept
+VarNames = ["SWin_corr", "SWout", "SWnet_corr", "LWin", "LWout_corr", "LWnet_model", "Hsen", "Hlat", "Gs",
+            "melt_energy", "totm_nrg", "rest_energy", "SumDivQ", "Tsurf_calc"]
 
 if station == "S5":
-    SEBdata = SEBf.SEB_data(FileName="PKM-data/S5_SEB_2003_2019_rp10b.txt")
+    SEBdata = SEBf.SEB_data(FileName="PKM-data/S5_SEB_2003_2019_rp10b.txt", VarNames=VarNames)
     
 elif station == "S6":
-    SEBdata = SEBf.SEB_data(FileName="PKM-data/S6_SEB_2003_2019_rp4.txt")
-    GsOld   = SEBdata.Extract_Variable("Gs")
+    SEBdata = SEBf.SEB_data(FileName="PKM-data/S6_SEB_2003_2019_rp4.txt", VarNames=VarNames)
+    GsOld   = SEBdata.Extract_Variable("Gs").copy()   # a view otherwise, which Correct_Gs_S6 changes
     SEBdata.Correct_Gs_S6()
 
 elif station == "S9":
-    SEBdata = SEBf.SEB_data(FileName="PKM-data/S9_SEB_2003_2019_5.txt")
+    SEBdata = SEBf.SEB_data(FileName="PKM-data/S9_SEB_2003_2019_5.txt", VarNames=VarNames)
     
 elif station == "S10":
-    SEBdata = SEBf.SEB_data(FileName="PKM-data/S10_SEB_2009_2019.txt")
+    SEBdata = SEBf.SEB_data(FileName="PKM-data/S10_SEB_2009_2019.txt", VarNames=VarNames)
 
 
 #%%
@@ -58,62 +61,61 @@ if station == "S6":
 # Daily averages       -> Daily
 
 PlotType = "AvgMonth"
+MinValid = 1.   # minimum fraction of valid data in a day or month; with 1. one gap gives no value
 
 if PlotType == "AvgMonth":
     # Example of plotting the typical yearly cycle
-    MyFunc = SEBf.get_avg_monthly_value
     Range  = [0, 12.5]
     Label  = "Month"
-    Xdata  = np.arange(14)
 elif PlotType == "Monthly":
     # Example of montly averages
-    MyFunc = SEBf.get_monthly_average
     Range  = [SEBdata.DateTime[0], SEBdata.DateTime[-1]]
     Label  = "Year"
-    # do dummy call to function to get the date-times for the x-axis
-    Xdata  = MyFunc(SHF, SEBdata.DateTime, GiveDatesBack=True)[1]
 elif PlotType == "Daily":
     # Example of montly averages
-    MyFunc = SEBf.get_daily_average
     # restrain ourselves to one year, I take here 2016
     Range  = [dt.datetime.fromisoformat("2016-01-01"), dt.datetime.fromisoformat("2017-01-01")]
     Label  = "Date"
-    # do dummy call to function to get the date-times for the x-axis
-    Xdata  = MyFunc(SHF, SEBdata.DateTime, GiveDatesBack=True)[1]
 
-
-MonthSWdownS = MyFunc(SWdown, SEBdata.DateTime, PrintInfo=True)
-MonthSWupS   = MyFunc(SWup, SEBdata.DateTime)
-
-# however, it is easier to do the call to the SEBf-function in the plot call...
+# all fluxes in the figure are averaged in one go
+Fluxes = {"SWdown": SWdown, "SWup": -SWup, "LWdown": LWdown, "LWup": -LWup, "Rnet": SWnet+LWnet,
+          "SWnet": SWnet, "LWnet": LWnet, "SHF": SHF, "LHF": LHF, "Gs": Gs, "M": MeltS, "Residu": Residu}
+if station == "S6":
+    Fluxes.update({"SWint": -SWint, "Rnetsurf": SWnet+LWnet-SWint, "SWnetsurf": SWnet-SWint})
+Aggr = SEBf.get_aggregates(np.array(list(Fluxes.values())), SEBdata.DateTime, MinValid=MinValid, Periods=[PlotType])
+Avg  = dict(zip(Fluxes, Aggr[PlotType]))
+if PlotType == "AvgMonth":
+    Xdata = np.arange(14)
+else:
+    Xdata = Aggr[PlotType+"Date"]
 
 fig, axs = plt.subplots(2, sharex=True)
 
 # upper figure are the radiative fluxes
-axs[0].plot(Xdata, MonthSWdownS, 'b', linewidth=0.5, label="$SW_{down}$")
-axs[0].plot(Xdata, -MonthSWupS, 'b:', linewidth=0.5, label="$SW_{up}$")
+axs[0].plot(Xdata, Avg["SWdown"], 'b', linewidth=0.5, label="$SW_{down}$")
+axs[0].plot(Xdata, Avg["SWup"], 'b:', linewidth=0.5, label="$SW_{up}$")
 if station == "S6":
-    axs[0].plot(Xdata, MyFunc(-SWint, SEBdata.DateTime), 'b--', linewidth=0.5, label="$SW_{int}$")
+    axs[0].plot(Xdata, Avg["SWint"], 'b--', linewidth=0.5, label="$SW_{int}$")
 
-axs[0].plot(Xdata, MyFunc(LWdown, SEBdata.DateTime), 'r', linewidth=0.5, label="$LW_{down}$")
-axs[0].plot(Xdata, MyFunc(-LWup, SEBdata.DateTime), 'r:', linewidth=0.5, label="$LW_{up}$")
-axs[0].plot(Xdata, MyFunc(SWnet+LWnet, SEBdata.DateTime), 'k', linewidth=0.5, label="$R_{net}$")
+axs[0].plot(Xdata, Avg["LWdown"], 'r', linewidth=0.5, label="$LW_{down}$")
+axs[0].plot(Xdata, Avg["LWup"], 'r:', linewidth=0.5, label="$LW_{up}$")
+axs[0].plot(Xdata, Avg["Rnet"], 'k', linewidth=0.5, label="$R_{net}$")
 if station == "S6":
-    axs[0].plot(Xdata, MyFunc(SWnet+LWnet-SWint, SEBdata.DateTime), 'k:', linewidth=0.5, label="$R_{net surf}$")
+    axs[0].plot(Xdata, Avg["Rnetsurf"], 'k:', linewidth=0.5, label="$R_{net surf}$")
 axs[0].set_ylabel("Energy flux (W/m2)")
 axs[0].legend(loc='lower right') # well, no spot is nice
 axs[0].grid(True)
 
 if station == "S6":
-    axs[1].plot(Xdata, MyFunc(SWnet-SWint, SEBdata.DateTime), 'b', linewidth=0.5, label="$SW_{net surf}$")
+    axs[1].plot(Xdata, Avg["SWnetsurf"], 'b', linewidth=0.5, label="$SW_{net surf}$")
 else:
-    axs[1].plot(Xdata, MyFunc(SWnet, SEBdata.DateTime), 'b', linewidth=0.5, label="$SW_{net}$")
-axs[1].plot(Xdata, MyFunc(LWnet, SEBdata.DateTime), 'r', linewidth=0.5, label="$LW_{net}$")
-axs[1].plot(Xdata, MyFunc(SHF, SEBdata.DateTime), 'seagreen', linewidth=0.5, label="$SHF$")
-axs[1].plot(Xdata, MyFunc(LHF, SEBdata.DateTime), 'orange', linewidth=0.5, label="$LHF$")
-axs[1].plot(Xdata, MyFunc(Gs, SEBdata.DateTime), 'grey', linewidth=0.5, label="$Gs$")
-axs[1].plot(Xdata, MyFunc(MeltS, SEBdata.DateTime), 'purple', linewidth=0.5, label="$M$")
-axs[1].plot(Xdata, MyFunc(Residu, SEBdata.DateTime), 'k', linewidth=0.5, label="Residue SEB model")
+    axs[1].plot(Xdata, Avg["SWnet"], 'b', linewidth=0.5, label="$SW_{net}$")
+axs[1].plot(Xdata, Avg["LWnet"], 'r', linewidth=0.5, label="$LW_{net}$")
+axs[1].plot(Xdata, Avg["SHF"], 'seagreen', linewidth=0.5, label="$SHF$")
+axs[1].plot(Xdata, Avg["LHF"], 'orange', linewidth=0.5, label="$LHF$")
+axs[1].plot(Xdata, Avg["Gs"], 'grey', linewidth=0.5, label="$Gs$")
+axs[1].plot(Xdata, Avg["M"], 'purple', linewidth=0.5, label="$M$")
+axs[1].plot(Xdata, Avg["Residu"], 'k', linewidth=0.5, label="Residue SEB model")
 
 axs[1].set_ylabel("Energy flux (W/m2)")
 axs[1].legend(loc='lower right') # Again, no spot is nice
@@ -131,18 +133,11 @@ dtemp = 1.
 Tsurf = SEBdata.Extract_Variable("Tsurf_calc")
 LWmod = SEBf.convert_T_in_LWout(Tsurf)
 
-LWout = LWnet - LWdown
-Tatm   = SEBf.convert_LWout_in_T(-LWdown, Celcius=False)
-LWinDT = -SEBf.convert_T_in_LWout(Tatm+dtemp, Celcius=False)
-
-LWoutDTuc = LWnet - LWinDT
-TskinDT = SEBf.convert_LWout_in_T(LWoutDTuc)
-TskinDT = np.where(TskinDT>0., 0., TskinDT)
-LWoutDT = SEBf.convert_T_in_LWout(TskinDT)
-MeltTDT = MeltT + LWoutDT - LWoutDTuc
+# the extra LW down first warms the surface, what is left at the melting point goes into melt
+Sens = SEBf.get_melt_sensitivity(SWnet, LWdown, LWnet, SHF, LHF, MeltT, SEBdata.DateTime, SEBdata.TimeStep, dTemp=dtemp)
 
 fig2, ax2 = plt.subplots()
-ax2.plot(SEBdata.DateTime, SEBf.get_running_melt_sum(MeltTDT, SEBdata.TimeStep), 'r', label='Melt for +1K')
+ax2.plot(SEBdata.DateTime, Sens["Cumulative"][0], 'r', label='Melt for +1K')
 ax2.plot(SEBdata.DateTime, SEBf.get_running_melt_sum(MeltT,   SEBdata.TimeStep), 'g', label='Observed Melt')
 ax2.legend(loc='upper left')
 ax2.set_ylabel('Accumulated melt (m w.e.)')
@@ -151,5 +146,16 @@ ax2.set_xlim([SEBdata.DateTime[0], SEBdata.DateTime[-1]])
 ax2.set_ylim([0, 19])
 
 
+#%%
+
+# The sensitivity of the melt to the apparent atmospheric temperature, all perturbations in one go
 
+dtemps = np.linspace(-2., 3., 51)
+Sens   = SEBf.get_melt_sensitivity(SWnet, LWdown, LWnet, SHF, LHF, MeltT, SEBdata.DateTime, SEBdata.TimeStep,
+                                   dTemp=dtemps, Cumulative=False)
 
+fig3, ax3 = plt.subplots()
+ax3.plot(dtemps, np.mean(Sens["Annual"], axis=1), 'r')
+ax3.set_ylabel('Mean annual melt (m w.e.)')
+ax3.set_xlabel('Change of the apparent atmospheric temperature (K)')
+ax3.grid(True)
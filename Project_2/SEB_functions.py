@@ -10,6 +10,12 @@ import datetime as dt
 import numpy as np
 import re
 import os
+import io
+import json
+import hashlib
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # this file contains
 # Methods to read and process data presented in 
@@ -23,30 +29,98 @@ import os
 
 # the included functions are
 # the class SEB_data
+# read_table     reads a data file, or some of its columns, in one go (used by SEB_data)
+# read_chunks    reads a data file in chunks of a fixed number of lines, with the corrections of SEB_data
+# StreamAggregates, StreamMeltSum   get_aggregates and get_running_melt_sum for data that comes in chunks
+# as_datetime64, get_time_indices   the time axis as datetime64, and its year, month, day of year and hour
+# get_daily_average, get_monthly_average, get_avg_monthly_value accept DateTime as well as DateTime64
+# get_aggregates  daily, monthly and mean monthly values of many variables at once, NaN aware
+# get_running_melt_sum  cumulative melt of one or many series, restarts after gaps and optionally each year
+# get_melt_sensitivity  cumulative and annual melt for many perturbations of LWin (dT), SWin, SHF and LHF at once
+# file_signature, write_cache, read_cache   the binary cache (FileName+cache_suffix) that SEB_data keeps next to a data file
+# load_transect  reads the stations in parallel processes, on one hourly time axis [nstation, nvar, ntime]
+# PhaseTimer     optional timers of the phases of reading (SEB_data(..., Timers=PhaseTimer())), see also benchmark_SEB.py
 # more info? -> help(SEB_data)
 
 
-version = "1.1"
+version = "1.3"
+cache_suffix = ".sebcache"
+# the data files of the K-transect stations
+transect_files = {"S5":  "PKM-data/S5_SEB_2003_2019_rp10b.txt",
+                  "S6":  "PKM-data/S6_SEB_2003_2019_rp4.txt",
+                  "S9":  "PKM-data/S9_SEB_2003_2019_5.txt",
+                  "S10": "PKM-data/S10_SEB_2009_2019.txt"}
+# the variables Correct_Gs_S6 needs
+Gs_S6_variables = ["SWnet_corr", "SumDivQ", "LWnet_model", "Hsen", "Hlat", "melt_energy", "rest_energy", "Gs"]
+
+class PhaseTimer:
+    '''Wall time and number of passes of the phases of reading a data file, switched on by giving one to SEB_data
+    (Timers=PhaseTimer()). Start marks the beginning, Lap(Phase) adds the time since the previous mark to Phase.
+    The phases of SEB_data are "cache" (reading, checking and writing the cache), "header", "read" (the file
+    into memory), "tokenize" (finding the entries of each line), "convert" (text to numbers), "repair"
+    (time axis, invalid data and the corrections of the station) and "select" (VarNames and Float32).
+    One timer can be used for several files, the times add up.'''
+    def __init__(self):
+        self.Seconds = {}
+        self.Calls   = {}
+        self.Mark    = None
+
+    def Start(self):
+        self.Mark = time.perf_counter()
+
+    def Lap(self, Phase, Calls=1):
+        Now = time.perf_counter()
+        self.Seconds[Phase] = self.Seconds.get(Phase, 0.) + Now - self.Mark
+        self.Calls[Phase]   = self.Calls.get(Phase, 0) + Calls
+        self.Mark = Now
+
+    def Report(self, Show=True):
+        '''dictionary with per phase the total seconds, the number of passes and the share of the total time'''
+        Total  = sum(self.Seconds.values())
+        Report = {Phase: {"seconds": self.Seconds[Phase], "calls": self.Calls[Phase],
+                          "fraction": self.Seconds[Phase]/Total if Total > 0. else 0.} for Phase in self.Seconds}
+        if Show:
+            print("phase          seconds      calls   fraction")
+            for Phase, Entry in Report.items():
+                print("{0:12s} {1:9.3f} {2:10d} {3:9.1%}".format(Phase, Entry["seconds"], Entry["calls"], Entry["fraction"]))
+        return Report
+
 class SEB_data:
-    '''Version 1.1 of a python class that reads and organizes SEB model output,
+    '''Version 1.3 of a python class that reads and organizes SEB model output,
     derived from observations from the K-transect, Greenland'''
     
 
-    def __init__(self, FileName=""):
+    def __init__(self, FileName="", UseCache=True, VarNames=None, Float32=False, Timers=None):
         '''For the initialisation of this class, only the filename (including path) is needed.
         During the initialisation all data is read.
         The function works on all four provided data sets. It rectifies errors in the S5 and S6 data files.
+        With UseCache, the data is written to a binary cache next to the data file (FileName+cache_suffix),
+        and read from there (memory-mapped) as long as the data file and the version do not change.
+        With VarNames (a list of variable names) only these variables are kept, in this order; without cache
+        only their columns are read. With Float32, AllData is stored in single precision. Both save memory.
+        With Timers (a PhaseTimer) the time spent in each phase of reading is added to it.
         
         Output is a SEB_data-class object, containing the variables:
             ok             bool     data properly readed
             version        string   version of SEB_data
             FileName       string   name of the SEB data file, without path
-            nval           integer  number of 
+            nval           integer  number of time entries
+            nvar           integer  number of variables
+            Variables      list     names of the variables
+            VarIndex       dict     the entry of each variable in AllData
+            varvalid       array    [nvar], False for variables that are not reliable (S6: variable 51 and later).
+                                    Before version 1.3 it wrongly had one entry per time step [nval].
+            AllData        array    [nvar, nval], the data
+            DateTime       array    [nval], the time axis as datetime objects
+            DateTime64     array    [nval], the same time axis as numpy datetime64[s]
+            Year, Month, Doy, Hour  arrays [nval], year, month (1-12), day of year (1-366) and hour (0-23) of each entry
+            GsCorrected    bool     Correct_Gs_S6 has been applied
         '''
         
         self.ok = False
         self.version = "SEB_hourly_data version "+version
         self.FileName = re.split(r'/+', FileName)[-1] # remove path
+        self.GsCorrected = False
         
         if FileName=="":
             print("A FileName is required!")
@@ -54,131 +128,164 @@ class SEB_data:
         if not os.path.isfile(FileName):
             print("SEB data file "+FileName+" does not exist, return")
             return
-        
-        # first count number of lines and read the header
-        with open(FileName) as AWSfile:
-            self.nval = -1
-            for line in AWSfile:
-                if self.nval == -1:
-                    # remove trailing line break and split line on the spaces
-                    splitted_header = (line.strip()).split() 
-                    print("The header has {0:3d} entries.".format(np.size(splitted_header)))
-
-                    if splitted_header[0]=="year" and splitted_header[1]=="day":
-                        if splitted_header[2]=="hour":
-                            self.TimeStep = 3600.
-                            self.Hourly   = True
-                            ivstart = 3
-                            ntime   = 3
-                        else:    # assume daily data
-                            self.TimeStep = 86400.
-                            self.Hourly   = False
-                            ivstart = 2
-                            ntime   = 2
-                    else:
-                        print("We assumed that every header starts with 'year hour' (and a lot of spaces)")
-                        print("However, this file starts with '"+splitted_header[0]+
-                              "' and '"+splitted_header[1]+"'.")
-                        print("Fix this! (or ask someone to fix this)")
-                        return
-
-                    if splitted_header[ivstart]=="Time":
-                        ivstart+=1 # neglect this entry
-                        
-                    self.nvar = np.size(splitted_header) - ivstart
-                    self.Variables = splitted_header[ivstart:]
-
-                self.nval += 1
-        print("AWS file '{0:s}' has {1:5d} lines of data for {2:2d} variables, start reading it.".format(self.FileName, 
-                        self.nval, self.nvar))
+        if Timers is not None:
+            Timers.Start()
+
+        if UseCache:
+            if self.Read_Cache(FileName):
+                if Timers is not None:
+                    Timers.Lap("cache")
+                if VarNames is not None:
+                    self.Select_Variables(VarNames)
+                if Float32:
+                    self.AllData = self.AllData.astype(np.float32)
+                if Timers is not None:
+                    Timers.Lap("select")
+                return
+            # before reading, such that a change of the file during reading invalidates the cache
+            Signature = file_signature(FileName, Hash=True)
+            if Timers is not None:
+                Timers.Lap("cache")
+
+        # read the header first, such that only the requested columns are converted
+        with open(FileName, 'r') as AWSfile:
+            splitted_header = AWSfile.readline().split()
+        print("The header has {0:3d} entries.".format(np.size(splitted_header)))
+
+        HeaderInfo = parse_header(splitted_header)
+        if HeaderInfo is None:
+            return
+        self.TimeStep, ntime, ivstart = HeaderInfo
+        self.Hourly = ntime==3
+        if Timers is not None:
+            Timers.Lap("header")
+
+        self.Variables = splitted_header[ivstart:]
+        self.VarIndex  = {Var.strip(): v for v, Var in enumerate(self.Variables)}
+        isS6 = self.FileName=="S6_SEB_2003_2019_rp4.txt"
+
+        # the variables to keep (ivar) and the variables to read (icol), as numbers in the file.
+        # The S6 data of variable 29 and later is taken from the previous column at the end, see below.
+        if VarNames is None or UseCache:
+            ivar = np.arange(np.size(self.Variables))
+        else:
+            ivar = np.array([self.Find_Variable(VarName)[0] for VarName in VarNames], dtype=int)
+            ivar = ivar[ivar >= 0]
+        icol = np.unique(np.concatenate([ivar, ivar[ivar >= 29] - 1])) if isS6 else np.unique(ivar)
+
+        _, counts, table = read_table(FileName, usecols=np.concatenate([np.arange(ntime), ivstart + icol]), Timers=Timers)
+
+        self.nvar = np.size(ivar)
+        self.nval = np.size(counts)
+        print("AWS file '{0:s}' has {1:5d} lines of data for {2:2d} variables, start reading {3:2d} of them.".format(self.FileName,
+                        self.nval, np.size(self.Variables), self.nvar))
+
 
-        
-        self.AllData    = np.zeros( [ self.nvar, self.nval ])                
         self.yyddhh     = np.zeros( [ 3, self.nval ], dtype=int )
-        self.DateTime   = np.zeros( self.nval, dtype=dt.datetime )
-        self.nvarDate   = np.zeros( self.nval, dtype=int)    # the number of variables per time entry. Should be constant, but isn't for AWS5 data :-(
-        self.varvalid   = np.ones( self.nval, dtype=bool )
-        
-        # read data
-        with open(FileName) as AWSfile:
-            ival = -1
-            for line in AWSfile:
-                if ival>=0:
-                    splitted_line = (line.strip()).split()
-                    
-                    # the time stap has errors, neglect is as a whole except first entry
-                    self.yyddhh[:ntime,ival]   = [float(value) for value in splitted_line[:ntime]]
-
-                    if ival==0:
-                        # It is a bit lengthy to get the datetime format filled. 
-                        # It does not help that timedelta needs int32, while the array is int64.
-                        self.DateTime[ival]   = dt.datetime.fromisoformat(splitted_line[0][:4]+"-01-01") + dt.timedelta(days=int(self.yyddhh[1,ival]-1), hours=int(self.yyddhh[2,ival]))
-                    else:
-                        self.DateTime[ival] = self.DateTime[ival-1] + dt.timedelta(seconds=self.TimeStep)
-                        
-                    if self.yyddhh[0,ival] == -999:
-                        lvalid = False
-                        # fill year, doy and hour entries
-                        self.yyddhh[0,ival] = self.DateTime[ival].year
-                        ndays_dttype = self.DateTime[ival]-dt.datetime.fromisoformat(str(self.yyddhh[0,ival])+"-01-01")
-                        self.yyddhh[1,ival] = ndays_dttype.days + 1
-                        self.yyddhh[2,ival] = self.DateTime[ival].hour
-                    else:
-                        lvalid = True
-                    
-                    if lvalid==False:
-                        self.AllData[:, ival] = np.zeros(self.nvar)*np.NAN
-                        
-                    elif np.size(splitted_line)-ivstart == self.nvar:
-                        self.AllData[:, ival] = [float(value) for value in splitted_line[ivstart:]]
-                        self.nvarDate[ival]   = self.nvar
-                         
-                    elif np.size(splitted_line)-ivstart == self.nvar+1 and self.FileName=="S6_SEB_2003_2019_rp4.txt":
-# this needs to be fixed - it isn't fixable here. Specific data"repair" is done below.
-                        self.AllData[:, ival] = [float(value) for value in splitted_line[ivstart:-1]]
-                        self.nvarDate[ival]   = self.nvar+1
+        self.varvalid   = np.ones( self.nvar, dtype=bool )
 
-                    elif self.FileName=="S6_SEB_2003_2019_rp4.txt":
-# this needs to be fixed - it isn't fixable here. Specific data"repair" is done below.
-                        self.nvarDate[ival]   = np.size(splitted_line)-ivstart
-                        self.AllData[:self.nvarDate[ival], ival] = [float(value) for value in splitted_line[ivstart:]]
+        ColData = np.ascontiguousarray(table[:, ntime:].T)    # [np.size(icol), nval]
+        self.yyddhh[:ntime, :] = table[:, :ntime].T
+        del table
+        if Timers is not None:
+            Timers.Lap("convert", Calls=0)
 
-                    else:
-                        print("Errors should not occur in other dataset than the one for S6.")
-                ival += 1
+        # the time stamp has errors, neglect it as a whole except the first entry
+        # It is a bit lengthy to get the datetime format filled.
+        # It does not help that timedelta needs int32, while the array is int64.
+        TimeStart = dt.datetime.fromisoformat("{0:04d}-01-01".format(self.yyddhh[0,0])) + dt.timedelta(days=int(self.yyddhh[1,0]-1), hours=int(self.yyddhh[2,0]))
+        self.DateTime64 = np.datetime64(TimeStart, 's') + np.arange(self.nval)*np.timedelta64(int(self.TimeStep), 's')
+        self.DateTime   = self.DateTime64.astype(dt.datetime)
+        self.Year, self.Month, self.Doy, self.Hour = get_time_indices(self.DateTime64)
+
+        # fill year, doy and hour entries of invalid time stamps
+        invalid = self.yyddhh[0,:] == -999
+        self.yyddhh[0,invalid] = self.Year[invalid]
+        self.yyddhh[1,invalid] = self.Doy[invalid]
+        self.yyddhh[2,invalid] = self.Hour[invalid]
+
+        # the number of variables per time entry. Should be constant, but isn't for AWS5 data :-(
+        # invalid entries, -999 and the errors in the S6 data are turned into NaN
+        self.nvarDate = correct_data(ColData, icol, counts - ivstart, invalid, np.size(self.Variables), self.FileName)
 
-        
         print("Reading completed.")
-        
-        # turn invalid data into NaN
-        self.AllData = np.where(self.AllData==-999., np.NaN, self.AllData)
-        
+
         # Well, I wished the S6 data was error free and consistent, but it isn't.
-        if self.FileName=="S6_SEB_2003_2019_rp4.txt":
+        if isS6:
             print("Apply data corrections...")
-            # missed invalid data, likely due to station mainenance
-            self.AllData[:,17270] = np.zeros(self.nvar)*np.NaN
-            self.AllData[:,17271] = np.zeros(self.nvar)*np.NaN
-            self.AllData[:,17273] = np.zeros(self.nvar)*np.NaN
-            self.AllData[:,17274] = np.zeros(self.nvar)*np.NaN
-            
-            # a variable dissapears somehow...
-            self.AllData[29:,114288:] = self.AllData[28:-1,114288:]
-            self.AllData[28, 114288:] = self.AllData[28, 114288:] * np.NaN
-            
-            # variables 51 and higher look odd - remove
-            self.AllData[51:,:] = self.AllData[51:,:] * np.NaN
-            self.varvalid[51:]  = False
+            self.varvalid[ivar>=51] = False
             print("We discard variable 51 ({0:s}, countinf from 0) and later as the data does not look consistent.".format(self.Variables[51]))
             print("It is further advised to call self.Correct_Gs_S6() as the Ground Heat Flux has sometimes erroneous data.")
         elif self.FileName=="S5_SEB_2003_2019_rp10b.txt" or self.FileName=="S9_SEB_2003_2019_5.txt" or self.FileName=="S10_SEB_2009_2019.txt":
             print("No data corrections needed for this station.")
         else:
             print("There are no data corrections know for this file, but that doesn't imply these are not necessary.")
-                
-        
+
+        # keep the requested variables only
+        if np.array_equal(icol, ivar):
+            self.AllData = ColData
+        else:
+            self.AllData = ColData[np.searchsorted(icol, ivar), :]
+        del ColData
+        self.Variables = [self.Variables[v] for v in ivar]
+        self.VarIndex  = {Var.strip(): v for v, Var in enumerate(self.Variables)}
+        if Timers is not None:
+            Timers.Lap("repair")
+
+        self.ok = True
+        if UseCache:
+            self.Write_Cache(FileName, Signature)
+            if Timers is not None:
+                Timers.Lap("cache", Calls=0)
+            if VarNames is not None:
+                self.Select_Variables(VarNames)
+        if Float32:
+            self.AllData = self.AllData.astype(np.float32)
+        if Timers is not None:
+            Timers.Lap("select")
 
         return
+
+    def Read_Cache(self, FileName):
+        '''Takes the data from the cache of FileName, if that exists and is up to date. Returns whether this worked.
+        The arrays are memory-mapped copy-on-write: processes reading the same station share the memory,
+        changes (like Correct_Gs_S6) stay in this object.'''
+        header, arrays = read_cache(FileName + cache_suffix)
+        if header is None or header["version"] != self.version or header["FileName"] != self.FileName:
+            return False
+        # a touched, but unchanged, file is still fine
+        Signature = file_signature(FileName)
+        if Signature["size"] != header["source"]["size"]:
+            return False
+        if Signature["mtime_ns"] != header["source"]["mtime_ns"] and \
+           file_signature(FileName, Hash=True)["sha1"] != header["source"]["sha1"]:
+            return False
+
+        for key in ["TimeStep", "Hourly", "nvar", "nval", "Variables", "GsCorrected"]:
+            setattr(self, key, header[key])
+        for key in ["AllData", "yyddhh", "nvarDate", "varvalid", "DateTime64"]:
+            setattr(self, key, arrays[key])
+        self.VarIndex = {Var.strip(): v for v, Var in enumerate(self.Variables)}
+        self.DateTime = self.DateTime64.astype(dt.datetime)
+        self.Year, self.Month, self.Doy, self.Hour = get_time_indices(self.DateTime64)
+        print("AWS file '{0:s}' with {1:5d} lines of data for {2:2d} variables is read from its cache.".format(self.FileName,
+                        self.nval, self.nvar))
+        self.ok = True
+        return True
+
+    def Write_Cache(self, FileName, Signature=None):
+        '''Writes the data to the cache of FileName. Signature is the file_signature (with hash) of FileName
+        taken before it was read. Failing to write the cache (e.g. a read-only directory) is not an error.'''
+        if Signature is None:
+            Signature = file_signature(FileName, Hash=True)
+        header = {"version": self.version, "FileName": self.FileName, "source": Signature}
+        for key in ["TimeStep", "Hourly", "nvar", "nval", "Variables", "GsCorrected"]:
+            header[key] = getattr(self, key)
+        arrays = {key: getattr(self, key) for key in ["AllData", "yyddhh", "nvarDate", "varvalid", "DateTime64"]}
+        try:
+            write_cache(FileName + cache_suffix, header, arrays)
+        except OSError as error:
+            print("The cache of '{0:s}' could not be written: {1}".format(self.FileName, error))
     
     def List_Variables(self):
         print("  #: Variable")
@@ -189,25 +296,32 @@ class SEB_data:
                 print("{0:3d}: ERASED {1:11s}".format(ivar+1, self.Variables[ivar]))
     
     
+    def Select_Variables(self, VarNames):
+        '''Keeps only the variables VarNames, in this order, to save memory. Unknown variables are left out.'''
+        ivar = np.array([self.Find_Variable(VarName)[0] for VarName in VarNames], dtype=int)
+        ivar = ivar[ivar >= 0]
+        self.AllData   = self.AllData[ivar, :]
+        self.varvalid  = self.varvalid[ivar]
+        self.Variables = [self.Variables[v] for v in ivar]
+        self.VarIndex  = {Var.strip(): v for v, Var in enumerate(self.Variables)}
+        self.nvar      = np.size(ivar)
+
     def Find_Variable(self, VarName):
-        '''This function finds the entry number of a Variable in the AllData array. 
+        '''This function finds the entry number of a Variable in the AllData array.
         Please note this function is case sensitive - your request should be exactly matching.'''
-        
-        lok      = True
-        VarIndex = -1
-        for v in range(self.nvar):
-            if VarName.strip() == self.Variables[v].strip():
-                VarIndex = v
-        if VarIndex == -1:
+
+        VarIndex = self.VarIndex.get(VarName.strip(), -1)
+        lok      = VarIndex != -1
+        if not lok:
             print("Variable '"+VarName+"' not found.")
-            lok = False
-        return VarIndex, lok  
+        return VarIndex, lok
 
 
     def Extract_Variable(self, VarName, NoDataForFail=True):
         '''This function extracts the data of a Variable from the main dataset AllData.
-        Unless the optional parameter NoDataForFail is set to False, no data is 
-          given if the requested variable name is not found.'''
+        Unless the optional parameter NoDataForFail is set to False, no data is
+          given if the requested variable name is not found.
+        The data is a view on AllData, not a copy: changing it changes AllData.'''
         
         VarIndex, lok = self.Find_Variable(VarName)
         if not self.varvalid[VarIndex] and lok:
@@ -219,10 +333,22 @@ class SEB_data:
         elif NoDataForFail:
             return
         else:
-            return np.zeros(self.nval)*np.NaN
+            return np.zeros(self.nval)*np.nan
+
+    def Aggregate_Variables(self, VarNames, MinValid=1., Periods=["Daily", "Monthly", "AvgMonth"]):
+        '''Daily, monthly and mean monthly values of a list of variables in one go, see get_aggregates.
+        Variables that are not found or erased give NaN.'''
+        VarData = np.array([self.Extract_Variable(VarName, NoDataForFail=False) for VarName in VarNames])
+        return get_aggregates(VarData, self.DateTime64, MinValid=MinValid, Periods=Periods)
         
     def Correct_Gs_S6(self):
-        if self.FileName=="S6_SEB_2003_2019_rp4.txt":
+        if self.GsCorrected:
+            print("The Ground Heat Flux has already been recalculated.")
+        elif self.FileName=="S6_SEB_2003_2019_rp4.txt":
+            Missing = [VarName for VarName in Gs_S6_variables if VarName not in self.VarIndex]
+            if Missing:
+                print("The recalculation of the Ground Heat Flux needs the variables "+", ".join(Missing)+".")
+                return
             print("Recalculate the Ground Heat Flux by assuming that all other reported fluxes are right.")
             SWnet  = self.Extract_Variable("SWnet_corr")
             SWint  = self.Extract_Variable("SumDivQ")
@@ -234,13 +360,269 @@ class SEB_data:
 
             Gs = - SWnet + SWint - LWnet - SHF - LHF + Residu + MeltS 
             
-            ivarGs = self.Find_Variable("Gs")
+            ivarGs, lok = self.Find_Variable("Gs")
             self.AllData[ivarGs, :] = Gs
+            self.GsCorrected = True
 
         else:
             print("This correction cannot be applied to other stations than S6")
         
         
+def read_table(FileName, usecols=None, Timers=None):
+    '''Reads a text file with a header line and whitespace separated numbers in one go.
+    Lines may have different numbers of entries.
+    With usecols (a list of column numbers) only these columns are converted, in this order.
+    With Timers (a PhaseTimer, started) the phases "read", "tokenize" and "convert" are timed.
+    Output:
+        header   list     the entries of the header line
+        counts   array    the number of entries of each data line
+        table    array    [number of lines, max(counts)] or [number of lines, len(usecols)], the data;
+                          missing entries are 0.
+    '''
+    with open(FileName, 'rb') as AWSfile:
+        header = AWSfile.readline().decode().split()
+        body   = AWSfile.read()
+    if Timers is not None:
+        Timers.Lap("read")
+    counts, table = parse_table(body, usecols, Timers)
+    return header, counts, table
+
+def parse_table(body, usecols=None, Timers=None):
+    '''The data part of read_table: converts the lines in body (bytes) to the number of entries
+    of each line and the table [number of lines, max(counts)] or [number of lines, len(usecols)].'''
+    # the number of entries per line follows from the positions where the entries start
+    chars      = np.frombuffer(body, dtype=np.uint8)
+    space      = chars <= 32 # blanks, tabs and line breaks
+    tokenstart = np.flatnonzero(~space[1:] & space[:-1]) + 1
+    if np.size(chars) > 0 and not space[0]:
+        tokenstart = np.concatenate([[0], tokenstart])
+    linestart  = np.concatenate([[0], np.flatnonzero(chars == ord('\n')) + 1])
+    if body.endswith(b'\n') or np.size(chars) == 0:
+        linestart = linestart[:-1]
+    counts = np.diff(np.searchsorted(tokenstart, np.append(linestart, np.size(chars))))
+    nline  = np.size(counts)
+    ncol   = np.max(counts) if nline > 0 else 0
+    del chars, space, tokenstart, linestart
+    if Timers is not None:
+        Timers.Lap("tokenize")
+
+    usecols = np.arange(ncol) if usecols is None else np.asarray(usecols, dtype=int)
+
+    # the lines with the usual number of entries are converted at once by numpy,
+    # the (few) other lines one by one
+    if np.all(counts == ncol) and np.all(usecols < ncol):
+        table = np.loadtxt(io.BytesIO(body), comments=None, ndmin=2, usecols=usecols).reshape(nline, np.size(usecols))
+    else:
+        table   = np.zeros([nline, np.size(usecols)])
+        lines   = body.split(b'\n')[:nline]
+        usual   = counts == np.argmax(np.bincount(counts))
+        inusual = usecols < counts[usual][0]
+        table[np.ix_(usual, inusual)] = np.loadtxt(io.BytesIO(b'\n'.join([line for line, lusual in zip(lines, usual) if lusual])),
+                                                   comments=None, ndmin=2, usecols=usecols[inusual])
+        for iline in np.flatnonzero(~usual):
+            values = lines[iline].split()
+            table[iline, :] = [float(values[icol]) if icol < len(values) else 0. for icol in usecols]
+    if Timers is not None:
+        Timers.Lap("convert")
+    return counts, table
+
+def parse_header(splitted_header):
+    '''Interprets the header of a SEB data file. Returns the time step (s), the number of time columns
+    and the column of the first variable, or None (with an explanation) if the header is not understood.'''
+    if splitted_header[0]=="year" and splitted_header[1]=="day":
+        if splitted_header[2]=="hour":
+            TimeStep = 3600.
+            ivstart  = 3
+            ntime    = 3
+        else:    # assume daily data
+            TimeStep = 86400.
+            ivstart  = 2
+            ntime    = 2
+    else:
+        print("We assumed that every header starts with 'year hour' (and a lot of spaces)")
+        print("However, this file starts with '"+splitted_header[0]+
+              "' and '"+splitted_header[1]+"'.")
+        print("Fix this! (or ask someone to fix this)")
+        return
+
+    if splitted_header[ivstart]=="Time":
+        ivstart+=1 # neglect this entry
+    return TimeStep, ntime, ivstart
+
+def correct_data(ColData, icol, nvarLine, invalid, nvarFile, FileName, iStart=0):
+    '''The corrections of SEB_data, in place, on the columns icol (variable numbers, sorted) of the lines
+    iStart:iStart+n of the data file FileName (without path): ColData is [np.size(icol), n].
+    nvarLine is the number of variables of each line, invalid marks the lines with an invalid time stamp
+    and nvarFile is the number of variables in the header.
+    Returns nvarDate, the number of variables of each line (0 for invalid lines).'''
+    isS6     = FileName=="S6_SEB_2003_2019_rp4.txt"
+    nvarDate = np.zeros(np.size(nvarLine), dtype=int)
+    regular  = ~invalid & (nvarLine == nvarFile)
+    nvarDate[regular] = nvarFile
+    if isS6:
+# this needs to be fixed - it isn't fixable here. Specific data"repair" is done below.
+# lines with one variable too many: the last one is neglected, shorter lines are filled with zeros.
+        irregular = ~invalid & ~regular
+        nvarDate[irregular] = nvarLine[irregular]
+    elif np.any(~invalid & ~regular):
+        print("Errors should not occur in other dataset than the one for S6.")
+        ColData[:, ~invalid & ~regular] = 0.
+    ColData[:, invalid] = np.nan
+
+    # turn invalid data into NaN
+    ColData[ColData==-999.] = np.nan
+
+    if isS6:
+        # missed invalid data, likely due to station mainenance
+        iline = np.array([17270, 17271, 17273, 17274]) - iStart
+        ColData[:, iline[(iline >= 0) & (iline < np.size(nvarLine))]] = np.nan
+
+        # a variable dissapears somehow...
+        ishift = icol >= 29
+        ifrom  = max(114288 - iStart, 0)
+        ColData[ishift,ifrom:] = ColData[np.searchsorted(icol, icol[ishift]-1),ifrom:]
+        ColData[icol==28, ifrom:] = np.nan
+
+        # variables 51 and higher look odd - remove
+        ColData[icol>=51,:] = np.nan
+    return nvarDate
+
+def read_chunks(FileName, VarNames=None, ChunkSize=8760):
+    '''Reads a SEB data file in chunks of ChunkSize lines, such that the memory use does not depend on the
+    length of the file. The data gets the same corrections as in SEB_data (but Correct_Gs_S6 is not applied).
+    VarNames = the variables to read (default all); unknown variables are left out
+    Yields for each chunk a dictionary with
+        Variables    list     the names of the variables
+        Data         array    [nvar, n], the data of the chunk
+        DateTime64   array    [n], its time axis
+        iStart       integer  the number of the first line of the chunk (from 0)
+        TimeStep     float    the time step (s)
+    '''
+    with open(FileName, 'rb') as AWSfile:
+        splitted_header = AWSfile.readline().decode().split()
+        HeaderInfo = parse_header(splitted_header)
+        if HeaderInfo is None:
+            return
+        TimeStep, ntime, ivstart = HeaderInfo
+        Variables = splitted_header[ivstart:]
+        VarIndex  = {Var.strip(): v for v, Var in enumerate(Variables)}
+        FileName  = re.split(r'/+', FileName)[-1] # remove path
+
+        # the variables to keep (ivar) and to read (icol), see SEB_data
+        if VarNames is None:
+            ivar = np.arange(np.size(Variables))
+        else:
+            ivar = np.array([VarIndex.get(VarName.strip(), -1) for VarName in VarNames], dtype=int)
+            for VarName in np.array(VarNames)[ivar < 0]:
+                print("Variable '"+VarName+"' not found.")
+            ivar = ivar[ivar >= 0]
+        isS6 = FileName=="S6_SEB_2003_2019_rp4.txt"
+        icol = np.unique(np.concatenate([ivar, ivar[ivar >= 29] - 1])) if isS6 else np.unique(ivar)
+        usecols = np.concatenate([np.arange(ntime), ivstart + icol])
+
+        iStart = 0
+        while True:
+            lines = list(itertools.islice(AWSfile, ChunkSize))
+            if not lines:
+                break
+            counts, table = parse_table(b''.join(lines), usecols)
+            del lines
+            if iStart == 0:
+                # as in SEB_data, only the first time stamp is used
+                yyddhh    = table[0, :ntime].astype(int)
+                TimeStart = dt.datetime.fromisoformat("{0:04d}-01-01".format(yyddhh[0])) + dt.timedelta(days=int(yyddhh[1]-1), hours=int(yyddhh[2]) if ntime==3 else 0)
+                TimeStart = np.datetime64(TimeStart, 's')
+            ColData = np.ascontiguousarray(table[:, ntime:].T)
+            invalid = table[:, 0].astype(int) == -999
+            del table
+            correct_data(ColData, icol, counts - ivstart, invalid, np.size(Variables), FileName, iStart)
+
+            n = np.size(counts)
+            yield {"Variables": [Variables[v] for v in ivar],
+                   "Data": ColData if np.array_equal(icol, ivar) else ColData[np.searchsorted(icol, ivar), :],
+                   "DateTime64": TimeStart + (iStart + np.arange(n))*np.timedelta64(int(TimeStep), 's'),
+                   "iStart": iStart, "TimeStep": TimeStep}
+            iStart += n
+
+def file_signature(FileName, Hash=False):
+    '''Size, modification time and (with Hash) the sha1 hash of a file, to see whether a cache of it is up to date.'''
+    stat = os.stat(FileName)
+    Signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if Hash:
+        hasher = hashlib.sha1()
+        with open(FileName, 'rb') as f:
+            for block in iter(lambda: f.read(1<<20), b''):
+                hasher.update(block)
+        Signature["sha1"] = hasher.hexdigest()
+    return Signature
+
+cache_magic = b"SEBCACHE1\n"
+
+def write_cache(CacheName, header, arrays):
+    '''Writes header (a dict that json can handle) and arrays (a dict of numpy arrays) to one binary file,
+    such that read_cache can memory-map the arrays.
+    The file starts with cache_magic, the length of the json header (8 bytes) and the header,
+    the arrays follow at page boundaries. It is written to a temporary file first, so that
+    other processes never see half a file.'''
+    header = dict(header, arrays={})
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.asarray(arr)
+        header["arrays"][name] = [arr.dtype.str, list(np.shape(arr)), offset]
+        offset += -(-arr.nbytes // 4096) * 4096
+    headerbytes = json.dumps(header).encode()
+    datastart = -(-(len(cache_magic) + 8 + len(headerbytes)) // 4096) * 4096
+
+    tmpname = "{0:s}.{1:d}.tmp".format(CacheName, os.getpid())
+    try:
+        with open(tmpname, 'wb') as f:
+            f.write(cache_magic + len(headerbytes).to_bytes(8, 'little') + headerbytes)
+            for name, arr in arrays.items():
+                f.seek(datastart + header["arrays"][name][2])
+                f.write(np.ascontiguousarray(arr).tobytes())
+            f.truncate(datastart + offset)
+        os.replace(tmpname, CacheName)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+def read_cache(CacheName):
+    '''Reads a file written by write_cache. Returns the header and the arrays, memory-mapped copy-on-write,
+    or None, None if the file does not exist or is not a cache file.'''
+    try:
+        with open(CacheName, 'rb') as f:
+            if f.read(len(cache_magic)) != cache_magic:
+                return None, None
+            headerlength = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(headerlength))
+    except (OSError, ValueError):
+        return None, None
+    datastart = -(-(len(cache_magic) + 8 + headerlength) // 4096) * 4096
+
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        if np.prod(shape) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.asarray(np.memmap(CacheName, dtype=dtype, mode='c', offset=datastart+offset, shape=tuple(shape)))
+    return header, arrays
+
+def as_datetime64(DateTime):
+    '''Returns a time axis (array of datetime objects or of datetime64) as numpy datetime64[s].'''
+    return np.asarray(DateTime).astype('datetime64[s]')
+
+def get_time_indices(DateTime):
+    '''Returns the year, month (1-12), day of year (1-366) and hour (0-23) of each entry of a time axis.'''
+    Time64  = as_datetime64(DateTime)
+    Year64  = Time64.astype('datetime64[Y]')
+    Month64 = Time64.astype('datetime64[M]')
+    Day64   = Time64.astype('datetime64[D]')
+    Year  = Year64.astype(int) + 1970
+    Month = (Month64 - Year64).astype(int) + 1
+    Doy   = (Day64 - Year64).astype(int) + 1
+    Hour  = (Time64 - Day64).astype('timedelta64[h]').astype(int)
+    return Year, Month, Doy, Hour
+
 def get_doy(year, month, day):
     timediff = dt.datetime(year=year, month=month, day=day) - dt.datetime(year=year, month=1, day=1)
     return timediff.days + 1
@@ -261,30 +643,118 @@ def convert_LWout_in_T(LWout, Celcius=True):
         
     return ( -LWout/5.67E-8 )**(0.25) - Tadd
 
-def get_running_melt_sum(MeltE, TimeStep, ResetAtNan=True):
-    '''The meltsum is in m w.e. per year'''
-    RmeltSum = np.zeros(np.size(MeltE))
-    for i in range(np.size(MeltE)):
-        if not np.isnan(MeltE[i]):
-            RmeltSum[i] = RmeltSum[i-1] + MeltE[i]*TimeStep/334000.
-        elif not ResetAtNan:
-            RmeltSum[i] = RmeltSum[i-1]
-        elif np.isnan(MeltE[i-1]):
-            RmeltSum[i-1] = np.NaN
-    
-    RmeltSum = RmeltSum/1000.
-    
+def get_running_melt_sum(MeltE, TimeStep, ResetAtNan=True, DateTime=None, RestartMonth=None):
+    '''The meltsum is in m w.e. per year.
+    MeltE can be one series [nval] or many series [nseries, nval]; these are accumulated along the last axis.
+    With ResetAtNan the sum restarts after a gap (NaN) and is NaN in the gap, except at its last entry (0).
+    Otherwise the sum stays constant during a gap.
+    With RestartMonth (1-12) and DateTime given, the sum restarts every year at the start of that month
+    (e.g. 9 for a hydrological year starting September 1).'''
+    MeltE  = np.asarray(MeltE, dtype=float)
+    isnan  = np.isnan(MeltE)
+    MeltDt = MeltE*TimeStep/334000.
+    MeltDt[isnan] = 0.
+    RmeltSum = np.cumsum(MeltDt, axis=-1)
+
+    # the entries where the sum restarts
+    restart = isnan.copy() if ResetAtNan else np.zeros(np.shape(MeltE), dtype=bool)
+    if RestartMonth is not None:
+        iYearStart = get_year_starts(DateTime, RestartMonth)
+        restart[..., iYearStart[iYearStart < np.shape(MeltE)[-1]]] = True
+    if np.any(restart):
+        # subtract the sum up to (not including) the last restart; in place, as there may be many series
+        ival  = np.broadcast_to(np.arange(np.shape(MeltE)[-1]), np.shape(MeltE))
+        ilast = np.where(restart, ival, -1)
+        np.maximum.accumulate(ilast, axis=-1, out=ilast)
+        before = ilast < 0
+        np.maximum(ilast, 0, out=ilast)
+        SumStart = np.take_along_axis(np.subtract(RmeltSum, MeltDt, out=MeltDt), ilast, axis=-1)
+        SumStart[before] = 0.
+        RmeltSum -= SumStart
+    if ResetAtNan:
+        # NaN in the gaps, but the last entry of a gap is 0
+        RmeltSum[..., :-1][isnan[..., :-1] & isnan[..., 1:]] = np.nan
+
+    RmeltSum /= 1000.
+
     return RmeltSum
-            
+
+def get_melt_sensitivity(SWnet, LWdown, LWnet, SHF, LHF, MeltE, DateTime, TimeStep,
+                         dTemp=1., SWfactor=1., SHFfactor=1., LHFfactor=1., ResetAtNan=True, StartMonth=1, Cumulative=True):
+    '''The melt for many perturbations of the surface energy balance at once.
+    The incoming longwave radiation follows from an apparent atmospheric temperature that is dTemp (K) warmer,
+    the incoming shortwave radiation (so with a constant albedo SWnet), SHF and LHF are multiplied by their factor.
+    The extra energy is first taken up by the outgoing longwave radiation, as the surface warms.
+    What is left when the surface reaches the melting point goes into melt (MeltE, W/m2).
+    This is the "+1 K" example of AnalyseSEBdata.py, for all perturbations (which are broadcast) in one pass.
+    SWnet, LWdown, LWnet, SHF, LHF, MeltE are the [nval] series of SEB_data, DateTime its time axis.
+    Output is a dictionary with
+        dTemp, SWfactor, SHFfactor, LHFfactor   arrays [nscen], the perturbations (after broadcasting, flattened)
+        Cumulative   array [nscen, nval], the running melt sum (m w.e.), see get_running_melt_sum (with Cumulative)
+        Annual       array [nscen, nyear], the melt (m w.e.) of each full year, starting at the first of StartMonth;
+                     gaps count as no melt
+        AnnualCount  array [nscen, nyear], the number of valid values per year
+        AnnualDate   array [nyear], the start of each year
+        Total        array [nscen], the melt (m w.e.) over the whole record
+    '''
+    dTemp, SWfactor, SHFfactor, LHFfactor = [np.array(Perturbation, dtype=float).ravel() for Perturbation in
+                                             np.broadcast_arrays(dTemp, SWfactor, SHFfactor, LHFfactor)]
+    Sens = {"dTemp": dTemp, "SWfactor": SWfactor, "SHFfactor": SHFfactor, "LHFfactor": LHFfactor}
+    LWout = LWnet - LWdown
+    Tatm  = convert_LWout_in_T(-LWdown, Celcius=False)
+
+    # the extra energy, one buffer for all scenarios: extra LWin, ...
+    Extra = np.add.outer(dTemp, Tatm)
+    Extra **= 4
+    Extra *= 5.67E-8
+    Extra -= LWdown
+    # ... and the scaled fluxes
+    Work = None
+    for Factor, Flux in [(SWfactor, SWnet), (SHFfactor, SHF), (LHFfactor, LHF)]:
+        if np.any(Factor != 1.):
+            if Work is None:
+                Work = np.empty_like(Extra)
+            np.multiply.outer(Factor - 1., Flux, out=Work)
+            Extra += Work
+    del Work
+
+    # the outgoing longwave radiation that would compensate the extra energy; at most that of a melting surface,
+    # the rest goes into melt. Like convert_LWout_in_T, a positive outgoing longwave radiation gives NaN.
+    MeltDT = np.subtract(LWout, Extra, out=Extra)
+    MeltDT[MeltDT > 0.] = np.nan
+    np.subtract(convert_T_in_LWout(0.), MeltDT, out=MeltDT)
+    np.maximum(MeltDT, 0., out=MeltDT)
+    MeltDT += MeltE
+
+    if Cumulative:
+        Sens["Cumulative"] = get_running_melt_sum(MeltDT, TimeStep, ResetAtNan=ResetAtNan)
+
+    # the annual melt
+    iYearStart = get_year_starts(DateTime, StartMonth)
+    Valid  = ~np.isnan(MeltDT)
+    np.nan_to_num(MeltDT, copy=False, nan=0.)
+    MeltDT *= TimeStep/334000./1000.
+    Sens["Total"] = np.sum(MeltDT, axis=1)
+    if np.size(iYearStart) > 1:
+        Sens["Annual"]      = np.add.reduceat(MeltDT[:, iYearStart[0]:iYearStart[-1]], iYearStart[:-1]-iYearStart[0], axis=1)
+        Sens["AnnualCount"] = np.add.reduceat(Valid[:, iYearStart[0]:iYearStart[-1]], iYearStart[:-1]-iYearStart[0], axis=1, dtype=int)
+    else:
+        Sens["Annual"]      = np.zeros([np.size(dTemp), 0])
+        Sens["AnnualCount"] = np.zeros([np.size(dTemp), 0], dtype=int)
+    Sens["AnnualDate"] = np.asarray(DateTime)[iYearStart[:-1]]
+    return Sens
+
 def get_daily_average(Var, DateTime, GiveDatesBack=False, PrintInfo=False):
     '''This function derives the daily averages of a variable.
-    It start at the first full day.'''
-    Istart = (24-DateTime[0].hour)%24
-    Ndays  = (DateTime[-1]-DateTime[0]).days
-    
+    It start at the first full day and ends with the last full day.
+    DateTime can be SEB_data.DateTime or SEB_data.DateTime64.'''
+    Time64 = as_datetime64(np.asarray(DateTime)[[0,-1]])
+    Istart = (24-get_time_indices(Time64[0])[3])%24
+    Ndays  = (np.size(Var)-Istart)//24 # only full days, also the last one if the record ends at 23:00
+
     if PrintInfo:
-        print("The date and hour of the first entry is {}.".format(DateTime[0].strftime("%B %d, %Y, %H:%M")))
-        print("The date and hour of the last entry is {}.".format(DateTime[-1].strftime("%B %d, %Y, %H:%M")))
+        print("The date and hour of the first entry is {}.".format(Time64[0].astype(dt.datetime).strftime("%B %d, %Y, %H:%M")))
+        print("The date and hour of the last entry is {}.".format(Time64[-1].astype(dt.datetime).strftime("%B %d, %Y, %H:%M")))
         print("The dataset contains data of {0:5d} days.".format(Ndays))
 
 # In order to do this in one call, I reshape the array into a 2D array and average over the second axis, thus the data of one day.    
@@ -296,66 +766,75 @@ def get_daily_average(Var, DateTime, GiveDatesBack=False, PrintInfo=False):
         return VarDay
     
 def get_next_month(DateTime):
+    if isinstance(DateTime, (np.datetime64, np.ndarray)):
+        return (as_datetime64(DateTime).astype('datetime64[M]') + 1).astype('datetime64[s]')
     if DateTime.month==12:
         return dt.datetime(year=DateTime.year+1, month=1, day=1)
     else:
         return dt.datetime(year=DateTime.year, month=DateTime.month+1, day=1)
     
     
+def get_month_starts(DateTime):
+    '''Returns the indices of the starts of the full months in a time axis with a constant time step,
+    from the first full month up to and including the end of the last full month.'''
+    Time64   = as_datetime64(np.asarray(DateTime)[[0,1,-1]])
+    TimeStep = Time64[1] - Time64[0]
+    # a record that starts exactly on the first of a month has that month as its first full month
+    Months   = np.arange((Time64[0] - np.timedelta64(1, 's')).astype('datetime64[M]') + 1,
+                         (Time64[-1] + TimeStep).astype('datetime64[M]') + 1, dtype='datetime64[M]')
+    # index of the first entry at or after the start of each month
+    return -((Time64[0] - Months.astype('datetime64[s]')) // TimeStep)
+
+def get_year_starts(DateTime, StartMonth=1):
+    '''Returns the indices of the starts of the full years in a time axis with a constant time step, the years
+    starting at the first of StartMonth (e.g. 9 for hydrological years), up to and including the end of the last full year.'''
+    Time64   = as_datetime64(np.asarray(DateTime)[[0,1,-1]])
+    TimeStep = Time64[1] - Time64[0]
+    # a record that starts exactly on the first of a month has that month as its first full month
+    Months   = np.arange((Time64[0] - np.timedelta64(1, 's')).astype('datetime64[M]') + 1,
+                         (Time64[-1] + TimeStep).astype('datetime64[M]') + 1, dtype='datetime64[M]')
+    Years    = Months[Months.astype(int) % 12 == StartMonth - 1]
+    # index of the first entry at or after the start of each year
+    return -((Time64[0] - Years.astype('datetime64[s]')) // TimeStep)
+
 def get_monthly_average(Var, DateTime, GiveDatesBack=False, PrintInfo=False):
     '''This function derives the monthly averages of a variable.
-    It start at the first full day.'''
-    
-    # find the start of the first full month
-    NextMonth = get_next_month(DateTime[0])
-    iStart = int( (NextMonth-DateTime[0]).days*24 + (NextMonth-DateTime[0]).seconds/3600 )
-
-    # find the number of months
-    nData  = np.size(DateTime)
-    iMS    = iStart
-    iME    = (get_next_month(DateTime[iMS])-DateTime[iMS]).days * 24
-    nMonth = 0
-    while iME<nData:
-        iMS     = iME
-        iME    += (get_next_month(DateTime[iME])-DateTime[iME]).days * 24
-        nMonth += 1
-    iFinal = iMS    
-    
+    It start at the first full month.
+    DateTime can be SEB_data.DateTime or SEB_data.DateTime64.'''
+
+    # find the starts of the full months
+    iMonthStart = get_month_starts(DateTime)
+    nMonth      = max(np.size(iMonthStart) - 1, 0)
+
     if PrintInfo:
-        print("The date and hour of the first entry is {}.".format(DateTime[0].strftime("%B %d, %Y, %H:%M")))
-        print("First full month starts at {}".format(DateTime[iStart].strftime("%B %d, %Y, %H:%M")))
-        print("The date and hour of the last entry is {}.".format(DateTime[-1].strftime("%B %d, %Y, %H:%M")))
-        print("Last full month end at {}".format(DateTime[iFinal-1].strftime("%B %d, %Y, %H:%M")))
+        Time64 = as_datetime64(np.asarray(DateTime)[[0, iMonthStart[0], -1, iMonthStart[-1]-1]])
+        print("The date and hour of the first entry is {}.".format(Time64[0].astype(dt.datetime).strftime("%B %d, %Y, %H:%M")))
+        print("First full month starts at {}".format(Time64[1].astype(dt.datetime).strftime("%B %d, %Y, %H:%M")))
+        print("The date and hour of the last entry is {}.".format(Time64[2].astype(dt.datetime).strftime("%B %d, %Y, %H:%M")))
+        print("Last full month end at {}".format(Time64[3].astype(dt.datetime).strftime("%B %d, %Y, %H:%M")))
         print("The dataset contains data of {0:3d} months.".format(nMonth))
-    
-    
-    VarMonth = np.zeros(nMonth)
-    VarDate  = np.zeros(nMonth, dtype=dt.datetime )
-    iMS = iStart
-    for iMonth in range(nMonth):
-        iME = iMS + (get_next_month(DateTime[iMS])-DateTime[iMS]).days * 24
-        VarMonth[iMonth] = np.mean(Var[iMS:iME])
-        VarDate[iMonth]  = DateTime[iMS]
-        iMS = iME
-        
+
+
+    VarMonth = np.array([np.mean(Var[iMS:iME]) for iMS, iME in zip(iMonthStart[:-1], iMonthStart[1:])])
+    VarDate  = np.asarray(DateTime)[iMonthStart[:-1]]
+
     if GiveDatesBack:
         return VarMonth, VarDate
     else:
         return VarMonth
-    
-    
+
+
 def get_avg_monthly_value(Var, DateTime, PrintInfo=False, GiveNumberOfMonths=False):
-    '''This function derives the mean monthly value of a variable'''
+    '''This function derives the mean monthly value of a variable.
+    DateTime can be SEB_data.DateTime or SEB_data.DateTime64.'''
     VarMonth, VarDate = get_monthly_average(Var, DateTime, GiveDatesBack=True, PrintInfo=PrintInfo)
     
+    iM    = get_time_indices(VarDate)[1]
+    # leave out months with no valid data
+    valid = ~np.isnan(VarMonth)
     VarMeanMonth = np.zeros(14)
-    Ndata        = np.zeros(13)
-    for iMonth in range(np.size(VarMonth)):
-        iM = VarDate[iMonth].month
-        # leave out months with no valid data
-        if not np.isnan(VarMonth[iMonth]):
-            VarMeanMonth[iM] += VarMonth[iMonth]
-            Ndata[iM]        += 1
+    VarMeanMonth[:13] = np.bincount(iM[valid], weights=VarMonth[valid], minlength=13)
+    Ndata             = np.bincount(iM[valid], minlength=13).astype(float)
     
     VarMeanMonth[1:13] = VarMeanMonth[1:13]/Ndata[1:13]
     VarMeanMonth[0]    = VarMeanMonth[12]
@@ -368,3 +847,311 @@ def get_avg_monthly_value(Var, DateTime, PrintInfo=False, GiveNumberOfMonths=Fal
    
 
 
+
+def get_day_starts(DateTime):
+    '''Returns the indices of the starts of the full days in a time axis with a constant time step,
+    from the first full day up to and including the end of the last full day.'''
+    Time64   = as_datetime64(np.asarray(DateTime)[[0,1,-1]])
+    TimeStep = Time64[1] - Time64[0]
+    Days     = np.arange((Time64[0] - np.timedelta64(1, 's')).astype('datetime64[D]') + 1,
+                         (Time64[-1] + TimeStep).astype('datetime64[D]') + 1, dtype='datetime64[D]')
+    # index of the first entry at or after the start of each day
+    return -((Time64[0] - Days.astype('datetime64[s]')) // TimeStep)
+
+def get_bin_average(Vars, iBinStart, MinValid=1.):
+    '''Averages of all rows of Vars [nvar, nval] over the bins iBinStart[i]:iBinStart[i+1].
+    NaNs are left out; a bin with less than a fraction MinValid of valid values is NaN.
+    Output are the averages and the number of valid values, both [nvar, nbin].'''
+    nbin = max(np.size(iBinStart) - 1, 0)
+    if nbin == 0:
+        return np.zeros([np.shape(Vars)[0], 0]), np.zeros([np.shape(Vars)[0], 0], dtype=int)
+    Part   = Vars[:, iBinStart[0]:iBinStart[-1]]
+    Valid  = ~np.isnan(Part)
+    Sums   = np.add.reduceat(np.where(Valid, Part, 0.), iBinStart[:-1]-iBinStart[0], axis=1)
+    Counts = np.add.reduceat(Valid, iBinStart[:-1]-iBinStart[0], axis=1, dtype=int)
+    Enough = (Counts > 0) & (Counts >= MinValid*np.diff(iBinStart))
+    return np.where(Enough, Sums/np.maximum(Counts, 1), np.nan), Counts
+
+def get_aggregates(Vars, DateTime, MinValid=1., Periods=["Daily", "Monthly", "AvgMonth"]):
+    '''Daily, monthly and mean monthly (typical yearly cycle) values of many variables at once.
+    The day and month boundaries are found once, and each average is one pass over all variables.
+    The bins are the full days and months of the record, the same as those of get_daily_average
+    and get_monthly_average, so with MinValid=1. the results equal theirs (to rounding).
+    Vars     = array [nvar, nval] (e.g. rows of SEB_data.AllData), [nval],
+               or with more dimensions, like the [nstation, nvar, nval] Data of load_transect
+    DateTime = SEB_data.DateTime or SEB_data.DateTime64
+    MinValid = minimum fraction of valid (not NaN) values in a day or month, otherwise it is NaN.
+               With MinValid=1. a single NaN gives NaN, like get_daily_average and get_monthly_average.
+               For AvgMonth the months that are NaN are left out, like get_avg_monthly_value.
+    Periods  = the aggregates to derive, from "Daily", "Monthly" and "AvgMonth"
+    Output is a dictionary with for each period P: P (the averages, [..., nbin]), P+"Count" (the number
+    of valid values, or for AvgMonth the number of months, per bin) and P+"Date" (start of each bin, not for AvgMonth).
+    AvgMonth has 14 entries: December, January ... December, January, as get_avg_monthly_value.
+    '''
+    Vars     = np.atleast_2d(Vars)
+    Shape    = np.shape(Vars)[:-1]
+    Vars     = Vars.reshape(-1, np.shape(Vars)[-1])
+    DateTime = np.asarray(DateTime)
+    Aggr     = {}
+
+    if "Daily" in Periods:
+        iDayStart = get_day_starts(DateTime)
+        Aggr["Daily"], Aggr["DailyCount"] = get_bin_average(Vars, iDayStart, MinValid)
+        Aggr["DailyDate"] = DateTime[iDayStart[:-1]]
+
+    if "Monthly" in Periods or "AvgMonth" in Periods:
+        iMonthStart = get_month_starts(DateTime)
+        VarMonth, CountMonth = get_bin_average(Vars, iMonthStart, MinValid)
+        VarDate = DateTime[iMonthStart[:-1]]
+        if "Monthly" in Periods:
+            Aggr["Monthly"], Aggr["MonthlyCount"], Aggr["MonthlyDate"] = VarMonth, CountMonth, VarDate
+
+    if "AvgMonth" in Periods:
+        Aggr["AvgMonth"], Aggr["AvgMonthCount"] = get_mean_annual_cycle(VarMonth, VarDate)
+
+    for key in Aggr:
+        if not key.endswith("Date"):
+            Aggr[key] = Aggr[key].reshape(Shape + np.shape(Aggr[key])[-1:])
+    return Aggr
+
+def get_mean_annual_cycle(VarMonth, VarDate):
+    '''The AvgMonth part of get_aggregates: the mean of each calendar month [nvar, 14] (December, January ... January)
+    of the monthly values VarMonth [nvar, nmonth] starting at VarDate, and the number of months [nvar, 13].'''
+    nvar  = np.shape(VarMonth)[0]
+    iM    = get_time_indices(VarDate)[1]
+    # leave out months with no valid data
+    valid = ~np.isnan(VarMonth)
+    iBin  = (np.arange(nvar)[:,None]*13 + iM[None,:])[valid]
+    Sums  = np.bincount(iBin, weights=VarMonth[valid], minlength=nvar*13).reshape(nvar, 13)
+    Ndata = np.bincount(iBin, minlength=nvar*13).reshape(nvar, 13)
+    VarMeanMonth = np.zeros([nvar, 14])
+    with np.errstate(invalid='ignore'):
+        VarMeanMonth[:,1:13] = Sums[:,1:13]/Ndata[:,1:13]
+    VarMeanMonth[:,0]  = VarMeanMonth[:,12]
+    VarMeanMonth[:,13] = VarMeanMonth[:,1]
+    return VarMeanMonth, Ndata
+
+class StreamAggregates:
+    '''
+    get_aggregates for a record that comes in chunks (e.g. from read_chunks), add them one by one with add.
+    Only the data of the current day and month is kept from one chunk to the next, the rest is summed directly.
+    The result is the same as that of get_aggregates for the whole record (with DateTime64).
+    '''
+    def __init__(self, MinValid=1., Periods=["Daily", "Monthly", "AvgMonth"]):
+        self.MinValid  = MinValid
+        self.Periods   = Periods
+        self.TimeFirst = None
+        self.TimeStep  = None
+        # the bins of each period, with the unit of their time stamps and the function that gives the full bins
+        self.Bins = {}
+        if "Daily" in Periods:
+            self.Bins["Daily"] = {"Unit": 'datetime64[D]', "Starts": get_day_starts}
+        if "Monthly" in Periods or "AvgMonth" in Periods:
+            self.Bins["Monthly"] = {"Unit": 'datetime64[M]', "Starts": get_month_starts}
+        for Bins in self.Bins.values():
+            Bins.update(Sums=[], Counts=[], NEntries=[], Start=[], Carry=None)
+
+    def add(self, Vars, DateTime64):
+        '''Adds a chunk: Vars [..., n] with time axis DateTime64 [n], following the previous chunk.'''
+        Vars = np.atleast_2d(Vars)
+        self.Shape = np.shape(Vars)[:-1]
+        Vars = Vars.reshape(-1, np.shape(Vars)[-1])
+        DateTime64 = as_datetime64(DateTime64)
+        if self.TimeFirst is None:
+            self.TimeFirst = DateTime64[0]
+        elif self.TimeStep is None:
+            self.TimeStep = DateTime64[0] - self.TimeFirst
+        if self.TimeStep is None and np.size(DateTime64) > 1:
+            self.TimeStep = DateTime64[1] - DateTime64[0]
+        self.TimeLast = DateTime64[-1]
+        for Bins in self.Bins.values():
+            self.add_bins(Bins, Vars, DateTime64)
+
+    def add_bins(self, Bins, Vars, DateTime64, Final=False):
+        '''Sums the bins that are complete (with Final all), the last one is carried to the next chunk.'''
+        if Bins["Carry"] is not None:
+            Vars       = np.concatenate([Bins["Carry"][0], Vars], axis=1)
+            DateTime64 = np.concatenate([Bins["Carry"][1], DateTime64])
+        Keys  = DateTime64.astype(Bins["Unit"])
+        iBinStart = np.concatenate([[0], np.flatnonzero(Keys[1:] != Keys[:-1]) + 1])
+        iEnd  = np.size(DateTime64) if Final else iBinStart[-1]
+        iBinStart = iBinStart if Final else iBinStart[:-1]
+        if np.size(iBinStart) > 0:
+            Part  = Vars[:, :iEnd]
+            Valid = ~np.isnan(Part)
+            Bins["Sums"].append(np.add.reduceat(np.where(Valid, Part, 0.), iBinStart, axis=1))
+            Bins["Counts"].append(np.add.reduceat(Valid, iBinStart, axis=1, dtype=int))
+            Bins["NEntries"].append(np.diff(np.append(iBinStart, iEnd)))
+            Bins["Start"].append(DateTime64[iBinStart])
+        Bins["Carry"] = (Vars[:, iEnd:].copy(), DateTime64[iEnd:].copy())
+
+    def result(self):
+        '''The aggregates of all chunks added, as get_aggregates. This ends the adding of chunks.'''
+        Aggr = {}
+        for Period, Bins in self.Bins.items():
+            self.add_bins(Bins, np.zeros([np.prod(self.Shape, dtype=int), 0]), np.zeros(0, dtype='datetime64[s]'), Final=True)
+            Sums     = np.concatenate(Bins["Sums"], axis=1)
+            Counts   = np.concatenate(Bins["Counts"], axis=1)
+            NEntries = np.concatenate(Bins["NEntries"])
+            Start    = np.concatenate(Bins["Start"])
+            # only the full bins, as get_aggregates
+            TimeStep = self.TimeStep if self.TimeStep is not None else np.timedelta64(0, 's')
+            iBinStart = Bins["Starts"](np.array([self.TimeFirst, self.TimeFirst + TimeStep, self.TimeLast]))
+            full   = np.isin(Start, self.TimeFirst + iBinStart[:-1]*TimeStep)
+            Enough = (Counts[:, full] > 0) & (Counts[:, full] >= self.MinValid*NEntries[full])
+            Aggr[Period]         = np.where(Enough, Sums[:, full]/np.maximum(Counts[:, full], 1), np.nan)
+            Aggr[Period+"Count"] = Counts[:, full]
+            Aggr[Period+"Date"]  = Start[full]
+
+        if "AvgMonth" in self.Periods:
+            Aggr["AvgMonth"], Aggr["AvgMonthCount"] = get_mean_annual_cycle(Aggr["Monthly"], Aggr["MonthlyDate"])
+        if "Monthly" not in self.Periods and "Monthly" in Aggr:
+            del Aggr["Monthly"], Aggr["MonthlyCount"], Aggr["MonthlyDate"]
+
+        for key in Aggr:
+            if not key.endswith("Date"):
+                Aggr[key] = Aggr[key].reshape(self.Shape + np.shape(Aggr[key])[-1:])
+        return Aggr
+
+class StreamMeltSum:
+    '''
+    get_running_melt_sum for a record that comes in chunks (e.g. from read_chunks).
+    add gives the running melt sum of the entries received so far except the last one, as that one
+    can still become NaN (with ResetAtNan, depending on the next entry); close gives that last entry.
+    Put together these are the same as get_running_melt_sum for the whole record.
+    '''
+    def __init__(self, TimeStep, ResetAtNan=True, RestartMonth=None):
+        self.TimeStep     = TimeStep
+        self.ResetAtNan   = ResetAtNan
+        self.RestartMonth = RestartMonth
+        self.Sum          = None # the sum of all entries so far
+        self.SumStart     = None # the sum before the last restart
+        self.Pending      = None # the last entry and whether it is NaN
+        self.FirstMonth   = None
+        self.LastMonth    = None
+
+    def add(self, MeltE, DateTime64=None):
+        '''Adds a chunk MeltE [n] or [nseries, n]; DateTime64 [n] is needed with RestartMonth.'''
+        MeltE  = np.asarray(MeltE, dtype=float)
+        OneSeries = MeltE.ndim == 1
+        MeltE  = np.atleast_2d(MeltE)
+        if self.Sum is None:
+            self.Sum      = np.zeros(np.shape(MeltE)[0])
+            self.SumStart = np.zeros(np.shape(MeltE)[0])
+        isnan  = np.isnan(MeltE)
+        MeltDt = MeltE*self.TimeStep/334000.
+        MeltDt[isnan] = 0.
+        # continue the cumulative sum of the previous chunks exactly
+        RmeltSum = np.cumsum(np.concatenate([self.Sum[:,None], MeltDt], axis=1), axis=1)[:,1:]
+
+        restart = isnan.copy() if self.ResetAtNan else np.zeros(np.shape(MeltE), dtype=bool)
+        if self.RestartMonth is not None:
+            Months = as_datetime64(DateTime64).astype('datetime64[M]')
+            if self.FirstMonth is None:
+                self.FirstMonth = self.LastMonth = Months[0]
+            # the first entry in the restart month of each year, not in the first month (see get_year_starts)
+            first = Months != np.concatenate([[self.LastMonth], Months[:-1]])
+            restart[:, first & (Months.astype(int) % 12 == self.RestartMonth - 1) & (Months > self.FirstMonth)] = True
+            self.LastMonth = Months[-1]
+        ival  = np.broadcast_to(np.arange(np.shape(MeltE)[1]), np.shape(MeltE))
+        ilast = np.where(restart, ival, -1)
+        np.maximum.accumulate(ilast, axis=1, out=ilast)
+        before = ilast < 0
+        np.maximum(ilast, 0, out=ilast)
+        SumStart = np.take_along_axis(np.subtract(RmeltSum, MeltDt, out=MeltDt), ilast, axis=1)
+        SumStart[before] = np.broadcast_to(self.SumStart[:,None], np.shape(SumStart))[before]
+        self.Sum, self.SumStart = RmeltSum[:,-1].copy(), SumStart[:,-1].copy()
+        RmeltSum -= SumStart
+
+        # hold back the last entry
+        if self.Pending is not None:
+            RmeltSum = np.concatenate([self.Pending[0], RmeltSum], axis=1)
+            isnan    = np.concatenate([self.Pending[1], isnan], axis=1)
+        if self.ResetAtNan:
+            # NaN in the gaps, but the last entry of a gap is 0
+            RmeltSum[:, :-1][isnan[:, :-1] & isnan[:, 1:]] = np.nan
+        self.Pending = (RmeltSum[:, -1:], isnan[:, -1:])
+        RmeltSum = RmeltSum[:, :-1]/1000.
+        return RmeltSum[0] if OneSeries else RmeltSum
+
+    def close(self, OneSeries=True):
+        '''The running melt sum of the last entry added, [1] (OneSeries) or [nseries, 1].'''
+        RmeltSum = self.Pending[0]/1000. if self.Pending is not None else np.zeros([1, 0])
+        return RmeltSum[0] if OneSeries else RmeltSum
+
+def transect_station(FileName, VarNames, UseCache=True, Float32=False):
+    '''One station of load_transect: the data of VarNames [nvar, nval] after the corrections of the station,
+    NaN for variables that the station does not have or that are erased.'''
+    LoadNames = list(VarNames) + [VarName for VarName in Gs_S6_variables if VarName not in VarNames]
+    SEBdata   = SEB_data(FileName, UseCache=UseCache, VarNames=LoadNames, Float32=Float32)
+    if not SEBdata.ok:
+        return None
+    if SEBdata.FileName=="S6_SEB_2003_2019_rp4.txt":
+        SEBdata.Correct_Gs_S6()
+
+    Data = np.full([len(VarNames), SEBdata.nval], np.nan, dtype=SEBdata.AllData.dtype)
+    for ivar, VarName in enumerate(VarNames):
+        VarIndex = SEBdata.VarIndex.get(VarName, -1)
+        if VarIndex >= 0 and SEBdata.varvalid[VarIndex]:
+            Data[ivar, :] = SEBdata.AllData[VarIndex, :]
+    return {"Data": Data, "DateTime64": SEBdata.DateTime64, "TimeStep": SEBdata.TimeStep}
+
+def load_transect(VarNames, Files=None, nworkers=None, UseCache=True, Float32=False, TimeStep=3600.):
+    '''Reads the data of several stations in parallel processes and puts them on one time axis,
+    from the first entry of the earliest station to the last entry of the latest one.
+    VarNames = the variables to read
+    Files    = dictionary of station name: data file, default transect_files
+    nworkers = number of processes, default is the number of cores
+    UseCache, Float32 are passed on to SEB_data; the S6 Ground Heat Flux is corrected with Correct_Gs_S6.
+    TimeStep = of the common time axis (s). Values of coarser (e.g. daily) data are repeated over their period.
+    Output is a dictionary with
+        Stations     list     the station names, a station that could not be read is all NaN
+        Variables    list     VarNames
+        Data         array    [nstation, nvar, ntime], NaN where a station has no data
+        DateTime64   array    [ntime], the time axis as numpy datetime64[s]
+        DateTime     array    [ntime], the time axis as datetime objects
+        TimeStep     float    TimeStep
+    Aggregates of all stations at once follow from get_aggregates(Transect["Data"], Transect["DateTime64"]).
+    As a process pool is used, call this from a script only under if __name__ == "__main__":
+    '''
+    if Files is None:
+        Files = transect_files
+    Stations = list(Files)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        futures = {pool.submit(transect_station, Files[Station], VarNames, UseCache, Float32): Station for Station in Stations}
+        for future in as_completed(futures):
+            Station = futures[future]
+            try:
+                results[Station] = future.result()
+            except Exception as err:
+                print("Station {0:s} could not be read: {1}".format(Station, err))
+                results[Station] = None
+            if results[Station] is not None and results[Station]["TimeStep"] % TimeStep != 0:
+                print("The time step of station {0:s} is not a multiple of {1:g} s, it is left out.".format(Station, TimeStep))
+                results[Station] = None
+
+    # the common time axis
+    Step   = np.timedelta64(int(TimeStep), 's')
+    Loaded = [result for result in results.values() if result is not None]
+    if Loaded:
+        TimeStart = min(result["DateTime64"][0] for result in Loaded)
+        TimeEnd   = max(result["DateTime64"][-1] + np.timedelta64(int(result["TimeStep"]), 's') for result in Loaded)
+        ntime     = int((TimeEnd - TimeStart) // Step)
+    else:
+        TimeStart, ntime = np.datetime64(0, 's'), 0
+    DateTime64 = TimeStart + np.arange(ntime)*Step
+
+    Data = np.full([len(Stations), len(VarNames), ntime], np.nan, dtype=np.float32 if Float32 else float)
+    for ist, Station in enumerate(Stations):
+        result = results[Station]
+        if result is None:
+            continue
+        nrepeat = int(result["TimeStep"] // TimeStep)
+        istart  = int((result["DateTime64"][0] - TimeStart) // Step)
+        nval    = np.shape(result["Data"])[1]*nrepeat
+        Data[ist, :, istart:istart+nval] = np.repeat(result["Data"], nrepeat, axis=1) if nrepeat > 1 else result["Data"]
+
+    return {"Stations": Stations, "Variables": list(VarNames), "Data": Data,
+            "DateTime64": DateTime64, "DateTime": DateTime64.astype(dt.datetime), "TimeStep": TimeStep}
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of SEB_functions: reading a data file (with the time per phase, see PhaseTimer),
+the binary cache, the aggregation functions and the running melt sum.
+The data files are synthetic, in the format of the S6 file (hourly, 55 variables, -999 entries,
+invalid time stamps and lines with too many or too few entries), such that the results do not
+depend on the PKM-data and can be reproduced anywhere.
+
+Example:
+    python benchmark_SEB.py --years 16 --repeat 3 --output benchmark_SEB.json
+The results are written as JSON: per benchmark the seconds of each repetition, their minimum and median.
+"""
+
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import numpy as np
+import SEB_functions as SEBf
+
+# the variables of the synthetic files, as in the S6 file, with their mean and standard deviation
+synthetic_variables = [("SWin_corr", 150., 100.), ("SWout", -110., 80.), ("SWnet_corr", 40., 30.),
+                       ("LWin", 260., 40.), ("LWout_corr", -300., 20.), ("LWnet_model", -40., 30.),
+                       ("Hsen", 20., 20.), ("Hlat", -5., 10.), ("Gs", 2., 5.), ("melt_energy", 20., 30.),
+                       ("totm_nrg", 20., 30.), ("rest_energy", 0., 5.), ("SumDivQ", 0., 5.), ("Tsurf_calc", -8., 6.)]
+synthetic_variables += [("var{0:02d}".format(ivar), 0., 100.) for ivar in range(len(synthetic_variables), 55)]
+# the variables of AnalyseSEBdata.py
+analysis_variables = ["SWin_corr", "SWout", "SWnet_corr", "LWin", "LWout_corr", "LWnet_model", "Hsen", "Hlat", "Gs",
+                      "melt_energy", "totm_nrg", "rest_energy", "SumDivQ", "Tsurf_calc"]
+
+
+def write_synthetic_file(FileName, nval, Seed=1, TimeStart=dt.datetime(2003, 4, 17, 5), Irregular=True):
+    '''Writes a synthetic hourly data file of nval lines in the format of the S6 file.
+    About 1% of the values is -999 and 0.2% of the time stamps is invalid; with Irregular
+    0.2% of the lines has one entry too many and 0.2% misses some entries.'''
+    rng   = np.random.default_rng(Seed)
+    nvar  = len(synthetic_variables)
+    Mean  = np.array([Variable[1] for Variable in synthetic_variables])
+    Std   = np.array([Variable[2] for Variable in synthetic_variables])
+    Data  = (Mean + Std*rng.standard_normal([nval, nvar])).round(3)
+    Data[:, 9] = np.abs(Data[:, 9])    # melt_energy
+    Data[rng.random([nval, nvar]) < 0.01] = -999.
+
+    DateTime64 = np.datetime64(TimeStart, 's') + np.arange(nval)*np.timedelta64(3600, 's')
+    Year, Month, Doy, Hour = SEBf.get_time_indices(DateTime64)
+    Time    = np.column_stack([Year, Doy, Hour, Doy + Hour/24.]).astype(float)
+    invalid = rng.random(nval) < 0.002
+    invalid[0] = False
+    Time[invalid, :] = -999.
+
+    Text = io.BytesIO()
+    np.savetxt(Text, np.hstack([Time, Data]), fmt=["%d", "%d", "%d", "%.4f"] + ["%g"]*nvar)
+    Lines = Text.getvalue().split(b"\n")[:nval]
+    if Irregular:
+        for iline in np.flatnonzero(rng.random(nval) < 0.002):
+            Lines[iline] += b" 0.5"
+        for iline in np.flatnonzero(rng.random(nval) < 0.002):
+            Lines[iline] = b" ".join(Lines[iline].split()[:4 + rng.integers(5, nvar)])
+
+    Header = "year  day  hour  Time  " + "  ".join(Variable[0] for Variable in synthetic_variables)
+    with open(FileName, "wb") as SEBfile:
+        SEBfile.write(Header.encode() + b"\n" + b"\n".join(Lines) + b"\n")
+
+
+def time_call(Function, Repeat, Setup=None, Verbose=False):
+    '''Runs Function Repeat times (after Setup, which is not timed), returns the timings and the last result.'''
+    Seconds = []
+    for irepeat in range(Repeat):
+        if Setup is not None:
+            Setup()
+        with contextlib.ExitStack() as Stack:
+            if not Verbose:
+                Stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            Start  = time.perf_counter()
+            Result = Function()
+            Seconds.append(time.perf_counter() - Start)
+    return {"seconds": Seconds, "min": min(Seconds), "median": float(np.median(Seconds)), "repeat": Repeat}, Result
+
+
+def benchmark_reading(FileName, Repeat, Verbose=False):
+    '''Parsing without cache (all variables and those of AnalyseSEBdata.py) with the time per phase,
+    writing the cache (cold) and reading it (warm), and read_chunks.'''
+    Results = {}
+    nval = None
+    for Name, VarNames in [("parse", None), ("parse_selection", analysis_variables)]:
+        Timers = SEBf.PhaseTimer()
+        Results[Name], SEBdata = time_call(lambda: SEBf.SEB_data(FileName, UseCache=False, VarNames=VarNames, Timers=Timers),
+                                           Repeat, Verbose=Verbose)
+        nval = SEBdata.nval
+        Results[Name]["lines_per_second"] = nval/Results[Name]["min"]
+        Results[Name]["phases"] = Timers.Report(Show=False)
+
+    def remove_cache():
+        if os.path.exists(FileName + SEBf.cache_suffix):
+            os.remove(FileName + SEBf.cache_suffix)
+    Results["cache_cold"], _ = time_call(lambda: SEBf.SEB_data(FileName), Repeat, Setup=remove_cache, Verbose=Verbose)
+    Results["cache_warm"], _ = time_call(lambda: SEBf.SEB_data(FileName), Repeat, Verbose=Verbose)
+    Results["read_chunks"], _ = time_call(lambda: sum(1 for Chunk in SEBf.read_chunks(FileName, analysis_variables)),
+                                          Repeat, Verbose=Verbose)
+    Results["nval"] = nval
+    return Results
+
+
+def benchmark_aggregates(FileName, Repeat, Verbose=False):
+    '''get_aggregates of all variables, the single variable functions and StreamAggregates.'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        SEBdata = SEBf.SEB_data(FileName, UseCache=False)
+    Melt = SEBdata.Extract_Variable("melt_energy")
+    Results = {}
+    Results["get_aggregates"], _  = time_call(lambda: SEBf.get_aggregates(SEBdata.AllData, SEBdata.DateTime64, 0.8), Repeat, Verbose=Verbose)
+    Results["get_aggregates"]["nvar"] = SEBdata.nvar
+    Results["get_daily_average"], _   = time_call(lambda: SEBf.get_daily_average(Melt, SEBdata.DateTime64), Repeat, Verbose=Verbose)
+    Results["get_monthly_average"], _ = time_call(lambda: SEBf.get_monthly_average(Melt, SEBdata.DateTime64), Repeat, Verbose=Verbose)
+    Results["get_avg_monthly_value"], _ = time_call(lambda: SEBf.get_avg_monthly_value(Melt, SEBdata.DateTime64), Repeat, Verbose=Verbose)
+
+    def stream():
+        Aggregates = SEBf.StreamAggregates(0.8)
+        for Chunk in SEBf.read_chunks(FileName):
+            Aggregates.add(Chunk["Data"], Chunk["DateTime64"])
+        return Aggregates.result()
+    Results["StreamAggregates"], _ = time_call(stream, Repeat, Verbose=Verbose)
+    Results["StreamAggregates"]["includes"] = "read_chunks"
+    return Results
+
+
+def benchmark_melt(FileName, Repeat, nscen=51, Verbose=False):
+    '''get_running_melt_sum (with resets at gaps and each hydrological year), StreamMeltSum
+    and get_melt_sensitivity for nscen temperature perturbations.'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        SEBdata = SEBf.SEB_data(FileName, UseCache=False, VarNames=analysis_variables)
+    Melt = SEBdata.Extract_Variable("melt_energy")
+    Results = {}
+    Results["get_running_melt_sum"], _ = time_call(lambda: SEBf.get_running_melt_sum(Melt, SEBdata.TimeStep), Repeat, Verbose=Verbose)
+    Results["get_running_melt_sum_yearly"], _ = time_call(lambda: SEBf.get_running_melt_sum(Melt, SEBdata.TimeStep,
+                                                          DateTime=SEBdata.DateTime64, RestartMonth=9), Repeat, Verbose=Verbose)
+
+    def stream():
+        MeltSum = SEBf.StreamMeltSum(SEBdata.TimeStep)
+        Parts   = [MeltSum.add(Melt[iStart:iStart+8760]) for iStart in range(0, SEBdata.nval, 8760)]
+        return Parts + [MeltSum.close()]
+    Results["StreamMeltSum"], _ = time_call(stream, Repeat, Verbose=Verbose)
+
+    Variables = [SEBdata.Extract_Variable(VarName) for VarName in ["SWnet_corr", "LWin", "LWnet_model", "Hsen", "Hlat", "melt_energy"]]
+    Results["get_melt_sensitivity"], _ = time_call(lambda: SEBf.get_melt_sensitivity(*Variables, SEBdata.DateTime64, SEBdata.TimeStep,
+                                                   dTemp=np.linspace(-2., 3., nscen)), Repeat, Verbose=Verbose)
+    Results["get_melt_sensitivity"]["nscen"] = nscen
+    return Results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of SEB_functions on synthetic S6-like data files.")
+    parser.add_argument("--years", type=float, default=16., help="length of the synthetic file in years (default 16, about the S6 file)")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of each benchmark (default 3)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic data (default 1)")
+    parser.add_argument("--only", nargs="+", choices=["reading", "aggregates", "melt"], default=["reading", "aggregates", "melt"],
+                        help="the benchmarks to run (default all)")
+    parser.add_argument("--datadir", default=None, help="directory for the synthetic files, kept afterwards (default a temporary directory)")
+    parser.add_argument("--output", default="benchmark_SEB.json", help="JSON file with the results (default benchmark_SEB.json)")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the benchmarked functions")
+    args = parser.parse_args()
+
+    DataDir  = tempfile.mkdtemp(prefix="benchmark_SEB_") if args.datadir is None else args.datadir
+    os.makedirs(DataDir, exist_ok=True)
+    # the S6 name, such that the S6 corrections are part of the benchmark
+    FileName = os.path.join(DataDir, "S6_SEB_2003_2019_rp4.txt")
+    nval     = int(args.years*8760)
+    print("Writing a synthetic data file of {0:d} lines to {1:s}".format(nval, FileName))
+    write_synthetic_file(FileName, nval, Seed=args.seed)
+
+    Output = {"benchmark": "SEB_functions", "version": SEBf.version,
+              "date": dt.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "numpy": np.__version__,
+              "platform": platform.platform(), "cpus": os.cpu_count(),
+              "arguments": vars(args), "file": {"nval": nval, "bytes": os.path.getsize(FileName)}, "results": {}}
+    Benchmarks = {"reading": benchmark_reading, "aggregates": benchmark_aggregates, "melt": benchmark_melt}
+    try:
+        for Name in args.only:
+            print("Benchmark " + Name)
+            Output["results"][Name] = Benchmarks[Name](FileName, args.repeat, Verbose=args.verbose)
+            for Key, Result in Output["results"][Name].items():
+                if isinstance(Result, dict):
+                    print("  {0:30s} {1:9.4f} s".format(Key, Result["min"]))
+    finally:
+        if args.datadir is None:
+            shutil.rmtree(DataDir)
+
+    with open(args.output, "w") as JSONfile:
+        json.dump(Output, JSONfile, indent=1)
+    print("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
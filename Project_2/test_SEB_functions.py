@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of SEB_functions, run with: python -m pytest Project_2
+"""
+
+import numpy as np
+import SEB_functions as SEBf
+
+
+def hourly_axis(Start, nval):
+    return np.datetime64(Start, 's') + np.arange(nval)*np.timedelta64(3600, 's')
+
+
+def test_year_starts_of_a_record_that_starts_on_the_boundary():
+    DateTime = hourly_axis('2010-01-01T00:00', 2*8760)
+    assert list(SEBf.get_year_starts(DateTime)) == [0, 8760, 17520]
+    DateTime = hourly_axis('2012-09-01T00:00', 2*8760)
+    assert list(SEBf.get_year_starts(DateTime, StartMonth=9)) == [0, 8760, 17520]
+    # a record that starts an hour later misses its first year
+    assert list(SEBf.get_year_starts(DateTime[1:], StartMonth=9)) == [8759, 17519]
+
+
+def test_annual_melt_includes_the_first_year():
+    DateTime = hourly_axis('2010-01-01T00:00', 2*8760)
+    Zero  = np.zeros(2*8760)
+    LWin  = np.full(2*8760, 250.)
+    Sens  = SEBf.get_melt_sensitivity(Zero, LWin, LWin - 300., Zero, Zero, np.full(2*8760, 10.),
+                                      DateTime, 3600., dTemp=[0., 1.])
+    assert np.shape(Sens["Annual"]) == (2, 2)
+    assert list(Sens["AnnualDate"]) == list(np.array(['2010-01-01', '2011-01-01'], dtype='datetime64[s]'))
+    assert np.allclose(Sens["Annual"][0], 10.*8760*3600./334000./1000.)
+
+
+def test_aggregates_include_the_first_month():
+    DateTime = hourly_axis('2010-01-01T00:00', 2*8760)
+    Vars = np.vstack([np.arange(2*8760.), np.ones(2*8760)])
+    Aggr = SEBf.get_aggregates(Vars, DateTime)
+    assert np.shape(Aggr["Monthly"]) == (2, 24) and np.shape(Aggr["Daily"]) == (2, 730)
+    assert Aggr["MonthlyDate"][0] == np.datetime64('2010-01-01T00:00', 's')
+    assert Aggr["Monthly"][0, 0] == np.mean(np.arange(744.))
+    assert np.all(Aggr["AvgMonthCount"][:, 1:] == 2)
+    assert np.allclose(SEBf.get_monthly_average(Vars[0], DateTime), Aggr["Monthly"][0])
+    assert np.allclose(SEBf.get_avg_monthly_value(Vars[0], DateTime), Aggr["AvgMonth"][0])
+    Stream = SEBf.StreamAggregates()
+    for iStart in range(0, 2*8760, 997):
+        Stream.add(Vars[:, iStart:iStart+997], DateTime[iStart:iStart+997])
+    Result = Stream.result()
+    assert all(np.array_equal(Result[key], Aggr[key]) for key in Aggr)